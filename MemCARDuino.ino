@@ -21,13 +21,36 @@
 
 //Device Firmware identifier
 #define IDENTIFIER "MCDINO"   //MemCARDuino
-#define VERSION 0x09          //Firmware version byte (Major.Minor).
+#define VERSION 0x0C          //Firmware version byte (Major.Minor).
 
 //Commands
 #define GETID 0xA0            //Get identifier
 #define GETVER 0xA1           //Get firmware version
 #define MCREAD 0xA2           //Memory Card Read (frame)
 #define MCWRITE 0xA3          //Memory Card Write (frame)
+#define MCREADN 0xA5          //Memory Card Read (consecutive frames)
+#define MCWRITEN 0xA6         //Memory Card Write (consecutive frames)
+#define MCREADC 0xA7          //Memory Card Read (consecutive frames, compact encoding)
+#define MCWRITEC 0xA8         //Memory Card Write (consecutive frames, compact encoding)
+#define GETSTATS 0xA9         //Get and reset timing counters
+
+//Compact frame encodings, first byte of a frame sent with MCREADC or MCWRITEC
+#define FRAME_RAW 0x00        //128 data bytes follow
+#define FRAME_FILL 0x01       //One byte follows, repeated 128 times
+#define FRAME_RLE 0x02        //Number of runs follows, then length and value of each run
+#define MAX_RUNS 63           //More runs than this take more bytes than the raw frame
+#define LINK_TIMEOUT 0x00     //Host stopped sending a compact frame
+#define LINK_BAD 0x4E         //Compact frame failed its check, answered like a bad checksum
+
+//Timing counters, sent by GETSTATS in this order
+#define STAT_FRAMES_READ 0    //Frames read from the card
+#define STAT_FRAMES_WRITTEN 1 //Frames written to the card
+#define STAT_BAD_STATUS 2     //Frames the card answered with a status other than RW_GOOD
+#define STAT_ACK_TIMEOUTS 3   //Bytes the card didn't ACK in time
+#define STAT_ACK_WAIT 4       //Microseconds spent polling for ACK
+#define STAT_PADDING 5        //Microseconds spent in fixed delays around card bytes
+#define STAT_CARD_BYTES 6     //Bytes exchanged with the card
+#define STATS_COUNT 7
 
 //PocketStation commands
 #define PSINFO  0xB0          //PocketStation info dump
@@ -93,6 +116,7 @@ bool CompatibleMode = false;
 bool SlowSPIMode = false;
 byte ReadData[128];
 int failedRWCount = 0;            //Count failed read/write attemps for fallback modes
+unsigned long Stats[STATS_COUNT]; //Timing counters since the last GETSTATS
 
 //Set up pins for communication
 void PinSetup()
@@ -169,12 +193,14 @@ byte SoftTransfer(byte data)
 byte SendCommand(byte CommandByte, int Timeout, int Delay)
 {
     if(!CompatibleMode) Timeout = 3000;
+    int Polls = Timeout;
     state = HIGH; //Set high state for ACK signal
 
     //Delay for a bit (values simulating delays between real PS1 and Memory Card)
     if (Delay > 0) 
     {
       delayMicroseconds(Delay);
+      Stats[STAT_PADDING] += Delay;
     }
 
     //Send data on the SPI bus
@@ -192,11 +218,17 @@ byte SendCommand(byte CommandByte, int Timeout, int Delay)
       if(Timeout == 0){
         //Timeout reached, card doesn't report ACK properly
         CompatibleMode = true;
+        Stats[STAT_ACK_TIMEOUTS]++;
         break;
       }
     }
     delayMicroseconds(20); // Extra delay for pocketstation. https://github.com/ShendoXT/memcarduino/pull/43
 
+    //Each poll waits at least 1us, so this is a lower bound
+    Stats[STAT_ACK_WAIT] += Polls - Timeout;
+    Stats[STAT_PADDING] += 20;
+    Stats[STAT_CARD_BYTES]++;
+
   return data;                    //Return the received byte
 }
 
@@ -204,10 +236,155 @@ byte SendCommand(byte CommandByte, int Timeout, int Delay)
 void AnalyzeStatus(byte status){
   //Nothing to analyze, all good
   if(status == RW_GOOD) return;
+
+  Stats[STAT_BAD_STATUS]++;
+}
+
+//Send the timing counters as a count byte and 4 bytes (LSB first) per counter, then start over
+void SendStats()
+{
+  Serial.write(STATS_COUNT);
+
+  for (int i = 0; i < STATS_COUNT; i++)
+  {
+    for (int j = 0; j < 4; j++)
+    {
+      Serial.write((byte)(Stats[i] >> (j * 8)));
+    }
+  }
+
+  memset(Stats, 0, sizeof(Stats));
+}
+
+//Wait for the next byte from the host, false once DelayCounter (ms) ran out
+bool SerialWait(int *DelayCounter)
+{
+  while(!Serial.available())
+  {
+    (*DelayCounter)--;
+    if(*DelayCounter == 0) return false;
+    delay(1);
+  }
+
+  return true;
+}
+
+//Send the frame in ReadData as a fill byte, runs or raw data, whichever is shortest
+//The check byte after it covers the encoded bytes, the card checksum only covers the data
+void SendCompactFrame()
+{
+  byte Runs = 1;
+  byte Check = 0;
+  for (int i = 1; i < 128; i++)
+  {
+    if(ReadData[i] != ReadData[i - 1]) Runs++;
+  }
+
+  if(Runs == 1)
+  {
+    Serial.write(FRAME_FILL);
+    Serial.write(ReadData[0]);
+    Check = FRAME_FILL ^ ReadData[0];
+  }
+  else if(Runs <= MAX_RUNS)
+  {
+    Serial.write(FRAME_RLE);
+    Serial.write(Runs);
+    Check = FRAME_RLE ^ Runs;
+
+    int Start = 0;
+    for (int i = 1; i <= 128; i++)
+    {
+      if(i == 128 || ReadData[i] != ReadData[Start])
+      {
+        Serial.write(i - Start);
+        Serial.write(ReadData[Start]);
+        Check ^= (i - Start) ^ ReadData[Start];
+        Start = i;
+      }
+    }
+  }
+  else
+  {
+    Serial.write(FRAME_RAW);
+    Serial.write(ReadData, 128);
+    Check = FRAME_RAW;
+    for (int i = 0; i < 128; i++)
+    {
+      Check ^= ReadData[i];
+    }
+  }
+
+  Serial.write(Check);      //Check byte (XOR of the encoded frame)
+}
+
+//Next byte from the host folded into Check, -1 once DelayCounter (ms) ran out
+int ReceiveByte(int *DelayCounter, byte *Check)
+{
+  if(!SerialWait(DelayCounter)) return -1;
+  byte Data = Serial.read();
+  *Check ^= Data;
+  return Data;
+}
+
+//Receive a frame encoded like SendCompactFrame does into ReadData
+//Returns RW_GOOD, LINK_BAD if the check byte or the runs don't add up or LINK_TIMEOUT if the host stopped sending
+byte ReceiveCompactFrame(int *DelayCounter)
+{
+  byte Check = 0;
+  int Data;
+  bool Valid = true;
+
+  int Encoding = ReceiveByte(DelayCounter, &Check);
+  if(Encoding < 0) return LINK_TIMEOUT;
+
+  if(Encoding == FRAME_RAW)
+  {
+    for (int i = 0; i < 128; i++)
+    {
+      if((Data = ReceiveByte(DelayCounter, &Check)) < 0) return LINK_TIMEOUT;
+      ReadData[i] = Data;
+    }
+  }
+  else if(Encoding == FRAME_FILL)
+  {
+    if((Data = ReceiveByte(DelayCounter, &Check)) < 0) return LINK_TIMEOUT;
+    memset(ReadData, Data, 128);
+  }
+  else if(Encoding == FRAME_RLE)
+  {
+    int Runs = ReceiveByte(DelayCounter, &Check);
+    int Length = 0;
+    if(Runs < 0) return LINK_TIMEOUT;
+
+    for (int i = 0; i < Runs; i++)
+    {
+      int Count = ReceiveByte(DelayCounter, &Check);
+      if(Count < 0 || (Data = ReceiveByte(DelayCounter, &Check)) < 0) return LINK_TIMEOUT;
+
+      //Keep reading past a bad run so the check byte is taken from where the host put it
+      if(Length + Count > 128) Valid = false;
+      else
+      {
+        memset(ReadData + Length, Data, Count);
+        Length += Count;
+      }
+    }
+
+    if(Length != 128) Valid = false;
+  }
+  else Valid = false;
+
+  //The check byte makes the XOR of the whole encoded frame 0
+  if(ReceiveByte(DelayCounter, &Check) < 0) return LINK_TIMEOUT;
+  if(!Valid || Check != 0) return LINK_BAD;
+
+  return RW_GOOD;
 }
 
 //Read a frame from Memory Card and send it to serial port
-void ReadFrame(unsigned int Address)
+//Compact frames are collected in ReadData first and sent encoded
+void ReadFrame(unsigned int Address, bool Compact)
 {
   byte AddressMSB = Address & 0xFF;
   byte AddressLSB = (Address >> 8) & 0xFF;
@@ -234,9 +411,12 @@ void ReadFrame(unsigned int Address)
   //Get 128 byte data from the frame
   for (int i = 0; i < 128; i++)
   {
-    Serial.write(SendCommand(0x00, 150, 0));
+    if(Compact) ReadData[i] = SendCommand(0x00, 150, 0);
+    else Serial.write(SendCommand(0x00, 150, 0));
   }
 
+  if(Compact) SendCompactFrame();
+
   Serial.write(SendCommand(0x00, 500, 0));      //Checksum (MSB xor LSB xor Data)
   StatusByte = SendCommand(0x00, 500, 0);       //Memory Card status byte
 
@@ -245,27 +425,41 @@ void ReadFrame(unsigned int Address)
   //Deactivate device
   digitalWrite(AttPin, HIGH);
 
+  Stats[STAT_FRAMES_READ]++;
   AnalyzeStatus(StatusByte);
 }
 
 //Write a frame from the serial port to the Memory Card
-void WriteFrame(unsigned int Address)
+//Returns false if the host stopped sending data
+bool WriteFrame(unsigned int Address, bool Compact)
 {
   byte AddressMSB = Address & 0xFF;
   byte AddressLSB = (Address >> 8) & 0xFF;
+  byte StatusByte = 0;
   int DelayCounter = 30;
 
   //Use ACK detection mode by default
   CompatibleMode = false;
 
   //Copy 128 bytes from the serial input
-  for (int i = 0; i < 128; i++)
+  if(Compact)
+  {
+    byte Received = ReceiveCompactFrame(&DelayCounter);
+    if(Received == LINK_TIMEOUT) return false;
+    if(Received == LINK_BAD)
+    {
+      if(SerialWait(&DelayCounter)) Serial.read();    //Checksum, the card never gets this frame
+      Serial.write(LINK_BAD);
+      return true;
+    }
+  }
+  else for (int i = 0; i < 128; i++)
   {
     while(!Serial.available())
     {
       DelayCounter--;
       if(DelayCounter == 0){
-        return;    //If there is no response for 30ms stop writing (prevents lock on MemCARDuino)
+        return false;    //If there is no response for 30ms stop writing (prevents lock on MemCARDuino)
       }delay(1);
     }
 
@@ -292,12 +486,50 @@ void WriteFrame(unsigned int Address)
   SendCommand(Serial.read(), 200, 0);      //Checksum (MSB xor LSB xor Data)
   SendCommand(0x00, 200, 0);               //Memory Card ACK1
   SendCommand(0x00, 200, 0);               //Memory Card ACK2
-  Serial.write(SendCommand(0x00, 0, 0));   //Memory Card status byte
+  StatusByte = SendCommand(0x00, 0, 0);    //Memory Card status byte
+  Serial.write(StatusByte);
 
   delayMicroseconds(500);
+  Stats[STAT_PADDING] += 500;
 
   //Deactivate device
   digitalWrite(AttPin, HIGH);
+
+  Stats[STAT_FRAMES_WRITTEN]++;
+  AnalyzeStatus(StatusByte);
+  return true;
+}
+
+//ReadFrame and WriteFrame take the address the way it's received (MSB in the low byte)
+unsigned int WireAddress(unsigned int Frame)
+{
+  return ((Frame >> 8) & 0xFF) | ((Frame & 0xFF) << 8);
+}
+
+//Frame number sent as MSB, LSB
+unsigned int ReadFrameNumber()
+{
+  unsigned int Frame = (Serial.read() & 0xFF) << 8;
+  return Frame | (Serial.read() & 0xFF);
+}
+
+//Read Count consecutive frames, each one is answered like MCREAD (data, checksum and status)
+void ReadFrames(unsigned int Frame, byte Count, bool Compact)
+{
+  for (int i = 0; i < Count; i++)
+  {
+    ReadFrame(WireAddress(Frame + i), Compact);
+  }
+}
+
+//Write Count consecutive frames, each one is sent (data and checksum) and answered like MCWRITE
+//The host sends the next frame after the status byte of the previous one, 128 bytes don't fit in the serial buffer
+void WriteFrames(unsigned int Frame, byte Count, bool Compact)
+{
+  for (int i = 0; i < Count; i++)
+  {
+    if(!WriteFrame(WireAddress(Frame + i), Compact)) return;    //Host stopped sending, drop the rest of the batch
+  }
 }
 
 //Get info from PocketStation
@@ -463,6 +695,10 @@ void loop()
         Serial.write(VERSION);
         break;
 
+      case GETSTATS:
+        SendStats();
+        break;
+
       case TEST:
         Serial.print(IDENTIFIER);
         Serial.print(" ");
@@ -486,12 +722,44 @@ void loop()
 
       case MCREAD:
         delay(5);
-        ReadFrame(Serial.read() | Serial.read() << 8);
+        ReadFrame(Serial.read() | Serial.read() << 8, false);
         break;
 
       case MCWRITE:
         delay(5);
-        WriteFrame(Serial.read() | Serial.read() << 8);
+        WriteFrame(Serial.read() | Serial.read() << 8, false);
+        break;
+
+      case MCREADN:
+        delay(5);
+        {
+          unsigned int Frame = ReadFrameNumber();
+          ReadFrames(Frame, Serial.read(), false);
+        }
+        break;
+
+      case MCWRITEN:
+        delay(5);
+        {
+          unsigned int Frame = ReadFrameNumber();
+          WriteFrames(Frame, Serial.read(), false);
+        }
+        break;
+
+      case MCREADC:
+        delay(5);
+        {
+          unsigned int Frame = ReadFrameNumber();
+          ReadFrames(Frame, Serial.read(), true);
+        }
+        break;
+
+      case MCWRITEC:
+        delay(5);
+        {
+          unsigned int Frame = ReadFrameNumber();
+          WriteFrames(Frame, Serial.read(), true);
+        }
         break;
     }
   }
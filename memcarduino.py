@@ -5,11 +5,11 @@
 #Notes for Python3
 #### Print and Pyserial are diferent in Py2 and Py3
 #### print "str" does not work in Py3 (only work in Py2) it must be changed to print (str)
-#### serial.write(b"MyBytes") only accept bytes in Py3 
+#### serial.write(b"MyBytes") only accept bytes in Py3
 #### serial.write("MyString") does not work in Py3, "Mystring" must be changed to serial.write(b"MyString")
 #### serial.read(int: number) is not a String, is a ByteArray.
 
-#Original Comment of 
+#Original Comment of
 #a simple command line tool for quick dumping of psx memory cards connected to a serially connected MemCARDuino project
 # made by Jason D'Amico on the 28/12/2014
 #	mr-fuji on 21/03/2015
@@ -18,469 +18,2397 @@
 #   Evans Jahja on 30/12/2025 (removed waits and added retries for pocketstation)
 #use and modification of this script is allowed, if improved do send a copy back.
 #use at own risk, not my fault if burns down house or erases card (it shouldn't, but...)
+
+#can also be imported, MemCardClient keeps one connection open for any number of operations:
+#	with MemCardClient("/dev/ttyACM0") as client:
+#		data = client.read_frame(0)
+import os
+import glob
+import mmap
+import hashlib
 import time
+import random
 import serial
 import sys
 import array
-from struct import pack
-from datetime import datetime
+from struct import pack, unpack
+from datetime import datetime, timedelta
 import getopt
+import inspect
+import csv
+import json
+import re
+import queue
+import select
+import socket
+import socketserver
+import threading
+try:
+	import termios
+	import tty
+	import fcntl
+except ImportError:	# windows, pyserial and tcp transports only
+	termios = None
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 global GID		# get identifier
 global GFV		# get firmware version
 global MCR	 	# mcr read command, should be followed by a verify memcard
 global MCW		# mcr write command, should be followed by a verify memcard
 global MCID		# read mc identifier
+global MCRN		# read consecutive frames, firmware 0.A and later
+global MCWN		# write consecutive frames, firmware 0.A and later
+global MCRC		# read consecutive frames with compact encoding, firmware 0.B and later
+global MCWC		# write consecutive frames with compact encoding, firmware 0.B and later
+global STATS	# get and reset the board's timing counters, firmware 0.C and later
 
 global PSINFO	# get information from pocketstation (serial, current time)
 global PSBIOS	# dump bios from pocketstation
 global PSTIME	# set current time to pocketstation
 
-global start		#first frame to read from (default 0)
-global end			#number of frames to read (default 1024)
-global frame_size	#size (in Bytes) of each frame (should remain 128)
-
-global inputport	#input port to use
-global rate			#bitrate to use
-global ser1			#serial
-global mode			#operation
-
 GID = b"\xA0"
 GFV = b"\xA1"
 MCR = b"\xA2"
 MCW = b"\xA3"
 MCID = b"\xA4"
+MCRN = b"\xA5"
+MCWN = b"\xA6"
+MCRC = b"\xA7"
+MCWC = b"\xA8"
+STATS = b"\xA9"
+
+BATCH_VERSION = 0x0A	# first firmware with MCRN and MCWN
+BATCH_FRAMES = 32		# frames per MCRN/MCWN request and how many reads queue ahead, a link error throws away what is queued
+COMPACT_VERSION = 0x0B	# first firmware with MCRC and MCWC
+STATS_VERSION = 0x0C	# first firmware with STATS
+# STATS counters in the order the firmware sends them, newer firmware may send more
+BOARD_STATS = ("frames_read", "frames_written", "bad_status", "ack_timeouts", "ack_wait_us", "padding_us", "card_bytes")
+
+# Compact frame encodings, first byte of every frame of a MCRC response or MCWC request
+FRAME_RAW = 0x00		# 128 data bytes follow
+FRAME_FILL = 0x01		# one byte follows, repeated for the whole frame
+FRAME_RLE = 0x02		# number of runs follows, then length and value of each run
+MAX_RUNS = 63			# more runs than this take more bytes than the raw frame
 
 PSINFO = b"\xB0"
 PSBIOS = b"\xB1"
 PSTIME = b"\xB2"
 
+BIOS_CHUNK = 128		# bytes per PSBIOS request
+BIOS_CHUNKS = 128
+BIOS_SIZE = BIOS_CHUNK * BIOS_CHUNKS
+BIOS_DEPTH = 4			# PSBIOS requests queued ahead, they are 2 bytes each
+BIOS_IDENTIFY_CHUNKS = 32	# chunks spread over the bios that have to match a cached image before the rest is taken from it
+BIOS_RELEASES = {0x27E94C07: "1st release", 0xB16CE96C: "2nd release", 0x1BABAF29: "dtl-h4000"}
+
+FRAMES_PER_BLOCK = 64	# a save block is 8 KiB
+DIRECTORY_FRAMES = 15	# frames 1-15 describe blocks 1-15, frame 0 is the "MC" header
+CARD_FRAMES = 1024		# a standard 128 KiB card
+MAX_FRAMES = 0x10000		# frame addresses are 16 bits
+
+# Directory frame block states
+BLOCK_FREE = 0xA0
+BLOCK_FIRST = 0x51		# first block of a save
+BLOCK_MIDDLE = 0x52
+BLOCK_LAST = 0x53
+BLOCK_DELETED_FIRST = 0xA1
+BLOCK_DELETED_MIDDLE = 0xA2
+BLOCK_DELETED_LAST = 0xA3
+
+STATE_NAMES = {BLOCK_FREE: "free", BLOCK_FIRST: "first", BLOCK_MIDDLE: "middle", BLOCK_LAST: "last",
+	BLOCK_DELETED_FIRST: "deleted first", BLOCK_DELETED_MIDDLE: "deleted middle", BLOCK_DELETED_LAST: "deleted last", 0xFF: "unusable"}
+
+WEEKDAYS = {1: "sunday", 2: "monday", 3: "tuesday", 4: "wednesday", 5: "thursday", 6: "friday", 7: "saturday"}
+
+MAX_DEPTH = 16		# MCR requests are 3 bytes, stay well inside the 64 byte serial buffer of AVR boards
+
+PROBE_TIMEOUT = 0.1	# seconds a running board takes at most to answer GETID
+READY_TIMEOUT = 5	# seconds a board that resets on open gets to come back up
+
+MAX_ATTEMPTS = 5		# tries per frame before it is reported as failed
+RETRY_DELAY = 0.05		# seconds before the first retry of a frame, doubles with every attempt
+RETRY_MAX_DELAY = 1.0
+
+CHECKPOINT_INTERVAL = 16	# confirmed frames between checkpoint saves
+
+INTER_BYTE_TIMEOUT = 0.1	# seconds of silence in the middle of a response before a read gives up
+TIMEOUT_SAFETY = 2			# adaptive response timeouts never go below this many times the bitrate transfer time of a frame
+TIMEOUT_MARGIN = 0.05		# plus this, so host or usb hiccups don't count as link errors
+LATENCY_SAMPLES = 8			# responses timed before the timeout follows the link instead of the blanket one
+ASYNC_LOW_LATENCY = 0x2000	# serial_struct flag, usb-serial drivers skip their latency timer
+
+DEVICE_MODES = ("READ", "WRITE", "FORMAT", "QUICKFORMAT", "LIST")	# operations that can run on several boards at once
+POCKETSTATION_MODES = ("PSINFO", "PSBIOS", "PSTIME")	# operations that don't need a memory card in the slot
+DAEMON_MODES = DEVICE_MODES + ("EXPORT", "IMPORT") + POCKETSTATION_MODES
+
+PROFILE_PHASES = ("transmit", "wait", "receive", "host")
+PROFILE_PERCENTILES = (50, 90, 99)
+PROFILE_HINTS = {"transmit": "writes to the usb adapter", "wait": "board and card turnaround or usb adapter latency",
+	"receive": "serial bitrate", "host": "host side processing"}
+
+DAEMON_SOCKET = "/tmp/memcarduino.sock"
+DAEMON_PROBE_INTERVAL = 30	# seconds an idle board goes between GETID checks in daemon mode
+
+class MemCARDuinoError(Exception):
+	"""Raised when the MemCARDuino or the card attached to it can't be talked to."""
+
 # Bytes Operators and Functions
 
 def ByteToHex( byteStr ): # byte to hex, ex: b'\x0A' -> 0A
 	return format(int.from_bytes(byteStr,byteorder='big'),'02x')
 
 def XorElementByteArray( byteStr):  # XOR of all elemment f Byte
-	result=0
-	for index in range(0, len(byteStr)):
-		result=result^byteStr[index]
+	#fold the bytes as one big integer, xoring its halves until a single byte is left
+	result = int.from_bytes(byteStr, byteorder='little')
+	width = len(byteStr) * 8
+	while width > 8:
+		width = (width + 15) // 16 * 8	# half, rounded up to whole bytes
+		result = (result >> width) ^ (result & ((1 << width) - 1))
 	return result
 
-# Help Functions
-def help():
-	print("memcarduino usage:")
-	print("memcarduino.py -p,--port <serial port> , -r,--read <output file> OR -w,--write <input file> OR -f,--format OR --psinfo OR --pstime OR --psbios <output file>, [-c,--capacity <capacity>] , [-b,--bitrate <bitrate:bps>]")
-	print("<serial port> accepts COM port names, or for linux, file references (/dev/tty[...] or others)")
-	print("<output file> read from memory card and save to file")
-	print("<input file> read from file and write to memory card (accepts both windows and linux file URI's)")
-	print("<capacyty> sets memory card capacity [frames] *1 frame = 128 B* (default 1024 frames)")
-	print("<bitrate> sets bitrate on serial port (default 115200 bps)")
-	print("format command formats memorycard with all \\x00\n")
+CARD_ERRORS = ("BAD CHECKSUM", "BAD SECTOR")	# reported by the card, anything else went wrong on the serial link
 
-	print("pocketstation commands:")
-	print("--psinfo (print info from pocketstation)")
-	print("--psbios <output file> (dump bios from pocketstation)")
-	print("--pstime (appy pc time to pocketstation)\n\n\n")
+def status_name(status):
+	#status byte as an int, -1 if it never arrived
+	if(status == 0x4E):
+		return "BAD CHECKSUM"
+	elif(status == 0xFF):
+		return "BAD SECTOR"
+	return "UNKNOWN ERROR"  # WTF?
 
-# Tests Functions
-def test():
-	ser.close()
-	ser.open()		# sometimes when serial port is opened, the arduino resets,so open, then wait for it to reset, then continue on with the check
-	time.sleep(2)
-	ser.isOpen()
-	
-	check_connection()
-def testFormat():
-	ser.close()
-	ser.open()		# sometimes when serial port is opened, the arduino resets,so open, then wait for it to reset, then continue on with the check
-	time.sleep(2)
-	ser.is_open()
-	
-	#check_connection() #throws error when the first frame is erased, which format does
-
-def check_connection():
-	temp = ""
-	print("running mcduino check")
-	#start mcduino verify 
-	ser.write(GID)
-	temp= ser.read(6)
-	if temp != b'MCDINO' :
-		print ("error: mcduino communication error, got")		  
-		print (temp)
-		print ("\" as identifier (should be \"MCDINO\")\n\n")
-		sys.exit()
+def map_image(file, size):
+	#preallocate size bytes of file and map them, so frames land at their own offset in whatever order they arrive
+	#None for files that can't be mapped (pipes, in-memory files, files opened write only)
+	try:
+		file.flush()
+		file.truncate(size)
+		return mmap.mmap(file.fileno(), size)
+	except (AttributeError, OSError, ValueError):
+		return None
 
-	#do not check frame reading for pocketstation commands
-	if (mode == "PSINFO" or mode == "PSBIOS" or mode == "PSTIME"):
-		return
+def get_bcd(value):
+	tens = value // 10
+	single = value - (tens * 10)
 
-	#test first frame
-	ser.write(MCR + b"\x00\x01")
-	temp=ser.read(129)
-	print(temp)
-	b = ser.read(1)
-	print (b)
-	if (b != b'\x47'):
-		print("Response Byte is: \n")
-		print(b)
-		print("error: mc read failure, check connections\n\n")
-		sys.exit()
-	print ("")
-
-# Memory Card Functions	
-def memcard_read(file):
-	f = file
-	temp = ""
-	print("reading data from memory card...\n")
-	passed = 0
-	for address in range(start, end):
+	return ((tens << 4) | single)
+
+# PocketStation Functions
+def ps_info_fields(b):
+	#the 0x12 bytes answered to PSINFO
+	psserial = b[6] | b[7] << 8 | b[8] << 16
+
+	return {
+		"serial": chr(b[9]) + "%08d" % (psserial),
+		"date": format(b[13], 'x') + format(b[12], 'x') + "/" + format(b[11], 'x') + "/" + format(b[10], 'x'),
+		"time": format(b[16], 'x') + ":" + format(b[15], 'x'),
+		"day": WEEKDAYS.get(b[17], ""),
+	}
+
+def ps_time_data(now):
+	#the 8 bcd bytes PSTIME sets the clock with
+	return bytearray([get_bcd(now.day),
+		get_bcd(now.month),
+		get_bcd(now.year % 100),
+		get_bcd(now.year // 100),
+		get_bcd(now.second),
+		get_bcd(now.minute),
+		get_bcd(now.hour),
+		get_bcd((now.weekday() + 2) % 7)])
+
+def bios_release(checksum):
+	#check if this is a known or maybe a bad dump
+	return BIOS_RELEASES.get(checksum, "unknown or bad dump, redump to verify")
+
+def bios_checksum(data):
+	#sum of the little endian 32 bit words, what tells the known releases apart
+	return sum(unpack("<"+str(len(data) // 4)+"I", data)) & 0xFFFFFFFF
+
+def load_bios_cache(directory):
+	#known bios images kept in directory as <checksum>.bin, only ones with the checksum of a known release count
+	images = {}
+	for path in glob.glob(os.path.join(directory, "*.bin")):
+		try:
+			with open(path, 'rb') as f:
+				data = f.read()
+		except OSError:
+			continue
+		if len(data) == BIOS_SIZE and bios_checksum(data) in BIOS_RELEASES:
+			images[bios_checksum(data)] = data
+	return images
+
+def save_bios(directory, image, checksum):
+	path = os.path.join(directory, format(checksum, '08x')+".bin")
+	if not os.path.exists(path):
+		os.makedirs(directory, exist_ok=True)
+		with open(path, 'wb') as f:
+			f.write(image)
+
+# Directory Functions
+def header_frame():
+	data_block = b"MC" #"MC"
+	data_block = data_block+(b"\x00"*125) #125 blanks
+	data_block = data_block+b"\x0E" #checksum
+	return data_block
+
+def frame_checksum(data_block):
+	#directory frames end with the XOR of their first 127 bytes
+	data_block = bytearray(data_block)
+	data_block[127] = XorElementByteArray(data_block[0:127])
+	return bytes(data_block)
+
+def free_directory_frame():
+	data_block = bytearray(128)
+	data_block[0] = BLOCK_FREE
+	data_block[8:10] = b"\xFF\xFF"	#no next block
+	return frame_checksum(data_block)
+
+def block_frames(block):
+	return range(block * FRAMES_PER_BLOCK, (block + 1) * FRAMES_PER_BLOCK)
+
+def directory_entry(data_block):
+	#fields of the directory frame describing one block
+	next_block = int.from_bytes(data_block[8:10], byteorder='little')
+	return {
+		"state": data_block[0],
+		"size": int.from_bytes(data_block[4:8], byteorder='little'),
+		"next": None if next_block == 0xFFFF else next_block + 1,	# stored as 0-14 for blocks 1-15
+		"name": bytes(data_block[10:31]).split(b"\x00")[0].decode('ascii', 'replace'),
+		"valid": XorElementByteArray(data_block[0:127]) == data_block[127],
+	}
+
+def link_chain(directory, block):
+	#blocks of the save starting at block, following the next block pointers
+	chain = [block]
+	next_block = directory_entry(directory[block])["next"]
+	while next_block in directory and next_block not in chain:
+		chain.append(next_block)
+		next_block = directory_entry(directory[next_block])["next"]
+	return chain
+
+def list_saves(directory):
+	#first block and chain of every save on the card
+	saves = []
+	for block in sorted(directory):
+		if directory_entry(directory[block])["state"] == BLOCK_FIRST:
+			saves.append((block, link_chain(directory, block)))
+	return saves
+
+def allocated_blocks(directory):
+	#every block that is not plainly free, a damaged directory frame counts as allocated
+	blocks = set()
+	for block, data in directory.items():
+		entry = directory_entry(data)
+		if entry["state"] != BLOCK_FREE or not entry["valid"]:
+			blocks.add(block)
+		if entry["state"] == BLOCK_FIRST:
+			blocks.update(link_chain(directory, block))
+	return blocks
+
+# Transports
+class Transport:
+	"""Byte link to a MemCARDuino with the part of the pyserial interface the clients use.
+
+	readinto and read return once count bytes arrived or after timeout seconds with fewer.
+	"""
+
+	timeout = 2
+
+	def read(self, size=1):
+		buffer = bytearray(size)
+		return bytes(buffer[0:self.readinto(buffer)])
+
+	def remaining(self, deadline):
+		return None if deadline is None else deadline - time.monotonic()
+
+	def deadline(self):
+		return None if self.timeout is None else time.monotonic() + self.timeout
+
+class TermiosTransport(Transport):
+	"""Serial port driven straight through termios, posix only (termios:/dev/ttyUSB0).
+
+	Reads wait in the kernel with VMIN set to the bytes still missing, so a response comes back
+	in one read instead of a wakeup per usb packet, and VTIME gives up on a response that stopped
+	halfway. ASYNC_LOW_LATENCY asks usb-serial drivers like ftdi_sio to skip their latency timer.
+	"""
+
+	def __init__(self, path, rate=115200, timeout=2):
+		self.path = path
+		self.rate = rate
+		self.timeout = timeout
+		self.fd = None
+		self.attrs = None
+		self.open()
+
+	def open(self):
+		speed = getattr(termios, "B"+str(self.rate), None)
+		if speed is None:
+			raise MemCARDuinoError("bitrate "+str(self.rate)+" not supported by termios")
+		try:
+			self.fd = os.open(self.path, os.O_RDWR | os.O_NOCTTY)
+		except OSError as e:
+			raise MemCARDuinoError("can't open "+self.path+": "+str(e))
+		tty.setraw(self.fd)
+		attrs = termios.tcgetattr(self.fd)
+		attrs[2] |= termios.CLOCAL | termios.CREAD
+		attrs[4] = attrs[5] = speed
+		attrs[6][termios.VMIN] = 1
+		attrs[6][termios.VTIME] = max(1, int(INTER_BYTE_TIMEOUT * 10))	# tenths of a second
+		termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+		self.attrs = attrs
+		self.set_low_latency()
+
+	def set_low_latency(self):
+		#only usb-serial and uart drivers have it, the port works without it, just with more latency
+		try:
+			serial_info = array.array('i', [0] * 32)
+			fcntl.ioctl(self.fd, termios.TIOCGSERIAL, serial_info)
+			serial_info[4] |= ASYNC_LOW_LATENCY		# flags field of struct serial_struct
+			fcntl.ioctl(self.fd, termios.TIOCSSERIAL, serial_info)
+		except (AttributeError, OSError):
+			pass
+
+	def set_vmin(self, count):
+		if self.attrs[6][termios.VMIN] != count:
+			self.attrs[6][termios.VMIN] = count
+			termios.tcsetattr(self.fd, termios.TCSANOW, self.attrs)
+
+	def readinto(self, buffer):
+		view = memoryview(buffer).cast('B')
+		received = 0
+		deadline = self.deadline()
+		while received < len(view):
+			wait = self.remaining(deadline)
+			if wait is not None and wait <= 0:
+				break
+			if not select.select([self.fd], [], [], wait)[0]:
+				break
+			#the response has started, let the kernel collect the rest of it
+			self.set_vmin(min(len(view) - received, 255))
+			count = os.readv(self.fd, [view[received:]])
+			if count == 0:
+				raise MemCARDuinoError("lost connection to "+self.path)
+			received += count
+		return received
+
+	def write(self, data):
+		view = memoryview(data)
+		while view:
+			view = view[os.write(self.fd, view):]
+		return len(data)
+
+	def reset_input_buffer(self):
+		termios.tcflush(self.fd, termios.TCIFLUSH)
+
+	def close(self):
+		if self.fd is not None:
+			os.close(self.fd)
+			self.fd = None
+
+class SocketTransport(Transport):
+	"""Raw tcp connection to a serial bridge like ser2net (tcp://host:port)."""
+
+	def __init__(self, host, port, timeout=2):
+		self.host = host
+		self.port = port
+		self.timeout = timeout
+		self.sock = None
+		self.open()
+
+	def open(self):
+		try:
+			self.sock = socket.create_connection((self.host, self.port), timeout=READY_TIMEOUT)
+		except OSError as e:
+			raise MemCARDuinoError("can't connect to "+self.host+":"+str(self.port)+": "+str(e))
+		self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)	# requests are a few bytes, don't let nagle hold them back
+
+	def readinto(self, buffer):
+		view = memoryview(buffer).cast('B')
+		received = 0
+		deadline = self.deadline()
+		while received < len(view):
+			wait = self.remaining(deadline)
+			if wait is not None and wait <= 0:
+				break
+			if received:
+				#the response has started, don't wait long for a gap in it
+				wait = INTER_BYTE_TIMEOUT if wait is None else min(wait, INTER_BYTE_TIMEOUT)
+			self.sock.settimeout(wait)
+			try:
+				count = self.sock.recv_into(view[received:])
+			except socket.timeout:
+				break
+			if count == 0:
+				raise MemCARDuinoError("connection to "+self.host+":"+str(self.port)+" closed")
+			received += count
+		return received
+
+	def write(self, data):
+		self.sock.sendall(data)
+		return len(data)
+
+	def reset_input_buffer(self):
+		#drop whatever already arrived
+		self.sock.setblocking(False)
+		try:
+			while self.sock.recv(4096):
+				pass
+		except (BlockingIOError, InterruptedError):
+			pass
+		finally:
+			self.sock.settimeout(self.timeout)
+
+	def close(self):
+		if self.sock is not None:
+			self.sock.close()
+			self.sock = None
+
+def open_transport(port, rate=115200, timeout=2):
+	#the port name picks the transport: tcp://host:port for raw tcp bridges, termios:<device> for the termios one,
+	#anything else goes to pyserial, which also takes rfc2217://host:port and its other urls
+	if port.startswith("tcp://"):
+		host, _, number = port[len("tcp://"):].rpartition(":")
+		return SocketTransport(host, int(number), timeout)
+	if port.startswith("termios:"):
+		if termios is None:
+			raise MemCARDuinoError("termios transport needs a posix system")
+		return TermiosTransport(port[len("termios:"):], rate, timeout)
+	return serial.serial_for_url(port, baudrate=rate, timeout=timeout, inter_byte_timeout=INTER_BYTE_TIMEOUT)
+
+class ProfiledTransport:
+	"""Passes everything through to a transport and charges the time of its calls to a Profile.
+
+	A readinto is split after the first byte, the time up to it is waiting on the board and the
+	rest is receiving. Plain reads only happen while recovering and count as waiting.
+	"""
+
+	def __init__(self, transport, profile):
+		self.transport = transport
+		self.profile = profile
+
+	@property
+	def timeout(self):
+		return self.transport.timeout
+
+	@timeout.setter
+	def timeout(self, timeout):
+		self.transport.timeout = timeout
+
+	def __getattr__(self, name):
+		return getattr(self.transport, name)
+
+	def write(self, data):
+		tstart = time.perf_counter_ns()
+		written = self.transport.write(data)
+		self.profile.current[0] += time.perf_counter_ns() - tstart
+		return written
+
+	def readinto(self, buffer):
+		view = memoryview(buffer)
+		tstart = time.perf_counter_ns()
+		received = self.transport.readinto(view[:1])
+		tfirst = time.perf_counter_ns()
+		if received and len(view) > 1:
+			received += self.transport.readinto(view[1:])
+		self.profile.current[1] += tfirst - tstart
+		self.profile.current[2] += time.perf_counter_ns() - tfirst
+		return received
+
+	def read(self, size=1):
+		tstart = time.perf_counter_ns()
+		data = self.transport.read(size)
+		self.profile.current[1] += time.perf_counter_ns() - tstart
+		return data
+
+class LatencyEstimator:
+	"""Smoothed time one kind of request takes and how much it varies, estimated like tcp does (rfc 6298).
+
+	timeout() stays at the ceiling until LATENCY_SAMPLES responses were timed and never goes below
+	floor, a response that timed out doubles the estimate so a link that really got slower is followed quickly.
+	"""
+
+	def __init__(self, ceiling, floor=TIMEOUT_MARGIN):
+		self.ceiling = ceiling
+		self.floor = floor
+		self.samples = 0
+		self.mean = 0.0
+		self.deviation = 0.0
+
+	def update(self, sample):
+		if self.samples == 0:
+			self.mean = sample
+			self.deviation = sample / 2
+		else:
+			self.deviation += (abs(sample - self.mean) - self.deviation) / 4
+			self.mean += (sample - self.mean) / 8
+		self.samples += 1
+
+	def expire(self):
+		self.mean = min(self.ceiling, self.mean * 2)
+
+	def timeout(self):
+		if self.samples < LATENCY_SAMPLES:
+			return self.ceiling
+		return min(self.ceiling, max(self.floor, self.mean + 4 * self.deviation))
+
+class FrameCodec:
+	"""Request and response buffers reused for every frame of one connection.
+
+	A MCR or MCW request is encoded in place and goes out in a single write, responses are
+	received into the same preallocated buffers with readinto, so a frame costs no allocations.
+	MCRN and MCWN requests only carry the first frame and a count, the frames of a MCWN batch
+	follow as write_data (data and XOR) one at a time.
+	With compact set frames travel as MCRC/MCWC encode them: a fill byte, runs or the raw data
+	and a check byte over those. The card's XOR only covers the decoded data, and a run of even
+	length XORs to zero whatever its value, so it can't vouch for the encoding on its own.
+	"""
+
+	runs = re.compile(rb"(.)\1*", re.DOTALL)
+
+	def __init__(self, frame_size=128):
+		self.frame_size = frame_size
+		self.read_request = bytearray(MCR + b"\x00\x00")
+		self.write_request = bytearray(MCW + bytes(frame_size + 3))	# MCW, MSB, LSB, data, XOR
+		self.write_view = memoryview(self.write_request)
+		self.write_data = self.write_view[3:]	# what a MCWN batch sends for each frame
+		self.batch_request = bytearray(4)	# MCRN or MCWN, MSB, LSB, count
+		self.frame = bytearray(frame_size)
+		self.frame_view = memoryview(self.frame)
+		self.tail = bytearray(2)	# XOR and status byte following the frame data of a MCR response
+		self.status = bytearray(1)	# status byte of a MCW response
+		self.compact = False		# firmware takes MCRC and MCWC
+
+	def encode_read(self, address):
+		self.read_request[1] = (address >> 8) & 0xFF
+		self.read_request[2] = address & 0xFF
+		return self.read_request
+
+	def encode_batch(self, command, address, count):
+		self.batch_request[0] = command[0]
+		self.batch_request[1] = (address >> 8) & 0xFF
+		self.batch_request[2] = address & 0xFF
+		self.batch_request[3] = count
+		return self.batch_request
+
+	def encode_write(self, address, data_block):
+		size = self.frame_size
+		request = self.write_request
+		request[1] = (address >> 8) & 0xFF
+		request[2] = address & 0xFF
+		if len(data_block) == size:
+			self.write_view[3:3 + size] = data_block
+		else:
+			self.write_view[3:3 + size] = bytes(data_block[0:size]).ljust(size, b"\x00")	# short image, pad the last frame
+		request[3 + size] = request[1] ^ request[2] ^ XorElementByteArray(self.write_view[3:3 + size])
+		return request
+
+	def encode_compact(self):
+		#data and XOR of the last encoded write the way a MCWC batch sends them
+		#fill byte, runs or raw data, then a check byte (XOR of the encoded frame) and the XOR of the data
+		request = self.write_request
+		size = self.frame_size
+		runs = bytearray()
+		for match in self.runs.finditer(request, 3, 3 + size):
+			if len(runs) == 2 * MAX_RUNS:
+				encoded = bytearray((FRAME_RAW,)) + request[3:3 + size]
+				break
+			runs += bytes((match.end() - match.start(), request[match.start()]))
+		else:
+			if len(runs) == 2:
+				encoded = bytearray((FRAME_FILL, runs[1]))
+			else:
+				encoded = bytearray((FRAME_RLE, len(runs) // 2)) + runs
+		encoded.append(XorElementByteArray(encoded))
+		encoded.append(request[-1])
+		return encoded
+
+	def receive(self, ser, buffer):
+		#data of one response frame into buffer, returns how many bytes arrived (frame_size when whole)
+		#0 only if nothing arrived, a compact frame cut short counts as at least the encoding byte
+		#-1 for a compact frame failing its check byte or with runs that don't add up to a frame
+		if not self.compact:
+			return ser.readinto(buffer)
+		size = self.frame_size
+		encoding = ser.read(1)
+		if not encoding:
+			return 0
+		if encoding[0] == FRAME_RAW:
+			received = ser.readinto(buffer)
+			if received < size:
+				return max(1, received)
+			check = ser.read(1)
+			if not check:
+				return size - 1
+			return size if XorElementByteArray(buffer) ^ encoding[0] == check[0] else -1
+		if encoding[0] == FRAME_FILL:
+			payload = ser.read(2)	# fill byte, check byte
+			if len(payload) < 2:
+				return 1
+			data = payload[0:1] * size
+		elif encoding[0] == FRAME_RLE:
+			runs = ser.read(1)
+			if not runs:
+				return 1
+			payload = runs + ser.read(2 * runs[0] + 1)	# number of runs, length and value of each, check byte
+			if len(payload) < 2 * runs[0] + 2:
+				return 1
+			data = b"".join(payload[index + 1:index + 2] * payload[index] for index in range(1, len(payload) - 1, 2))
+		else:
+			return -1
+		if len(data) != size or XorElementByteArray(encoding + payload) != 0:
+			return -1
+		buffer[:] = data
+		return size
+
+	def checksum(self):
+		#XOR byte of the last encoded write
+		return self.write_request[-1]
+
+class Profile:
+	"""Where the time of every frame went, in nanoseconds from perf_counter_ns.
+
+	transmit is spent in writes, wait blocked until the first byte of a response, receive from
+	there to its last byte and host is the rest of the frame: encoding, checksums, storing, logging.
+	The ProfiledTransport adds to the frame in progress, frame() closes it. With requests queued
+	ahead a frame also carries the writes of the ones behind it.
+	"""
+
+	def __init__(self):
+		self.frames = []		# (operation, address, ok, total, transmit, wait, receive, host)
+		self.board = None		# the board's STATS counters over the same run, firmware 0.C and later
+		self.current = [0, 0, 0]	# transmit, wait, receive of the frame in progress
+		self.mark = time.perf_counter_ns()
+
+	def start(self):
+		#a pass begins, time since the last frame (retry backoff, other work) doesn't belong to the next one
+		self.current = [0, 0, 0]
+		self.mark = time.perf_counter_ns()
+
+	def frame(self, operation, address, ok):
+		now = time.perf_counter_ns()
+		total = now - self.mark
+		transmit, wait, receive = self.current
+		self.frames.append((operation, address, ok, total, transmit, wait, receive, max(0, total - transmit - wait - receive)))
+		self.current = [0, 0, 0]
+		self.mark = now
+
+	def summary(self):
+		#percentiles and log2 histograms (upper bound in microseconds -> frames) per phase, times in microseconds
+		frames = len(self.frames)
+		seconds = sum(frame[3] for frame in self.frames) / 1e9
+		report = {"frames": frames, "failed": sum(1 for frame in self.frames if not frame[2]), "seconds": seconds,
+			"frames_per_second": frames / seconds if seconds else 0.0, "phases": {}}
+		for column, phase in enumerate(("total",) + PROFILE_PHASES, 3):
+			values = sorted(frame[column] for frame in self.frames)
+			if not values:
+				continue
+			stats = {"mean_us": sum(values) / len(values) / 1000, "max_us": values[-1] / 1000,
+				"share": sum(values) / 1e9 / seconds if seconds else 0.0, "histogram": {}}
+			for percentile in PROFILE_PERCENTILES:
+				stats["p"+str(percentile)+"_us"] = values[min(len(values) - 1, len(values) * percentile // 100)] / 1000
+			for value in values:
+				bound = 1 << max(0, (value // 1000).bit_length())
+				stats["histogram"][bound] = stats["histogram"].get(bound, 0) + 1
+			report["phases"][phase] = stats
+		if self.board is not None:
+			report["board"] = dict(self.board)
+		return report
+
+	def save(self, path):
+		#.csv gets a row per frame, anything else json with the summary and every frame
+		if path.endswith(".csv"):
+			with open(path, 'w', newline='') as f:
+				writer = csv.writer(f)
+				writer.writerow(("operation", "address", "ok", "total_ns") + tuple(phase+"_ns" for phase in PROFILE_PHASES))
+				writer.writerows(self.frames)
+			return
+		with open(path, 'w') as f:
+			json.dump({"summary": self.summary(), "frames": [dict(zip(("operation", "address", "ok", "total_ns") + tuple(phase+"_ns" for phase in PROFILE_PHASES), frame)) for frame in self.frames]}, f, indent=2)
+
+class Checkpoint:
+	"""Frames of an operation confirmed good (status 0x47), kept in a sidecar file so an interrupted run can resume.
+
+	The sidecar only matches a later run of the same operation over the same frame range and,
+	for writes, the same input image (digest). flush is called before every save so the frames
+	the checkpoint vouches for are on disk first. A sidecar that can't be written only costs the
+	ability to resume: log(message) is warned once and checkpointing turns off, the run goes on.
+	"""
+
+	def __init__(self, path, operation, start, end, digest="", flush=None, log=print):
+		self.path = path
+		self.operation = operation
+		self.start = start
+		self.end = end
+		self.digest = digest
+		self.flush = flush
+		self.log = log
+		self.enabled = True		#off once the sidecar couldn't be written
+		self.done = bytearray(end - start)
+		self.unsaved = 0
+
+	def load(self):
+		#True if the sidecar belongs to this operation, done is filled from it
+		try:
+			with open(self.path, 'r') as c:
+				state = json.load(c)
+		except (OSError, ValueError):
+			return False
+		if (state.get("operation"), state.get("start"), state.get("end"), state.get("digest")) != (self.operation, self.start, self.end, self.digest):
+			return False
+		bits = int(state.get("frames", "0"), 16)
+		for index in range(len(self.done)):
+			self.done[index] = (bits >> index) & 1
+		return True
+
+	def mark(self, address):
+		self.done[address - self.start] = 1
+		self.unsaved += 1
+		if self.unsaved >= CHECKPOINT_INTERVAL:
+			self.save()
+
+	def save(self):
+		self.unsaved = 0
+		if not self.enabled:
+			return
+		if self.flush is not None:
+			self.flush()
+		bits = 0
+		for index in range(len(self.done)):
+			if self.done[index]:
+				bits |= 1 << index
+		state = {"operation": self.operation, "start": self.start, "end": self.end, "digest": self.digest, "frames": format(bits, 'x')}
+		try:
+			with open(self.path + ".tmp", 'w') as c:
+				json.dump(state, c)
+			os.replace(self.path + ".tmp", self.path)
+		except OSError as e:
+			self.enabled = False
+			self.log("warning: can't save checkpoint "+self.path+" ("+str(e)+"), an interrupted run won't resume")
+
+	def remove(self):
+		try:
+			if os.path.exists(self.path):
+				os.remove(self.path)
+		except OSError as e:
+			self.log("warning: can't remove checkpoint "+self.path+" ("+str(e)+")")
+
+	def missing(self):
+		return [address for address in range(self.start, self.end) if not self.done[address - self.start]]
+
+class MemCardClient:
+	"""Connection to a MemCARDuino and the Memory Card or PocketStation attached to it.
+
+	The port stays open between calls so several operations share one connection.
+	start/end are the frame range the whole card operations work on, depth is the number
+	of frame reads kept queued on the serial link. Frames that fail are retried up to max_attempts
+	times after the rest of the operation. Progress is printed unless verbose is off.
+	A capacity of None probes the card for it (detect_capacity) when the card is checked.
+	"""
+
+	def __init__(self, port, rate=115200, capacity=1024, depth=1, timeout=2, verbose=True, max_attempts=MAX_ATTEMPTS, name=None):
+		self.port = port
+		self.name = name			#tags every progress line when several boards print at once
+		self.output = None			#takes the progress lines instead of stdout when set, one line per call
+		self.rate = rate
+		self.timeout = timeout
+		self.start = 0				#first frame to read from (default 0)
+		self.end = capacity or CARD_FRAMES	#number of frames to read (default 1024)
+		self.auto_capacity = capacity is None	#end comes from detect_capacity
+		self.detected = False		#detect_capacity ran on the card in the slot
+		self.frame_size = 128		#size (in Bytes) of each frame (should remain 128)
+		self.depth = max(1, min(depth, MAX_DEPTH))
+		self.verbose = verbose
+		self.ser = None
+		self.codec = FrameCodec(self.frame_size)
+		self.version = None			#firmware version byte, read when connecting
+		self.batch = False			#firmware takes MCRN and MCWN, runs of consecutive frames go out as one request
+		self.max_attempts = max(1, max_attempts)
+		self.errors = {}			#frame address -> status of every failed attempt, reported by result()
+		self.link_errors = 0		#frames mangled or cut short between the MemCARDuino and the host
+		self.card_errors = 0		#frames the card itself reported as bad
+		self.last_result = None		#outcome of the last whole card operation, set by result()
+		self.unread = []			#frames the last read_range gave up on
+		#time a frame response takes, sets how long to wait for one, never less than its bytes take at the bitrate
+		floor = (self.frame_size + 2) * 10.0 / rate * TIMEOUT_SAFETY + TIMEOUT_MARGIN
+		self.read_latency = LatencyEstimator(timeout, floor)
+		self.write_latency = LatencyEstimator(timeout, floor)
+		self.profile = None			#Profile the transport reports to, set before open
+
+	def __enter__(self):
+		if self.ser is None:
+			self.open()
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def log(self, *args, **kwargs):
+		if not self.verbose:
+			return
+		if self.name is None and self.output is None:
+			print(*args, **kwargs)
+			return
+		for line in " ".join(str(arg) for arg in args).splitlines():
+			if not line.strip():
+				continue
+			if self.name is not None:
+				line = "["+self.name+"] "+line
+			if self.output is not None:
+				self.output(line)
+			else:
+				print(line+"\n", end="")	# one write per line, other boards print at the same time
+
+	# Tests Functions
+	def open(self, check_card=True):
+		self.ser = open_transport(self.port, self.rate, self.timeout)
+		if self.profile is not None:
+			self.ser = ProfiledTransport(self.ser, self.profile)
+		self.test(check_card)
+		if self.profile is not None:
+			self.board_stats()		# so the counters start with the job
+
+	def close(self):
+		if self.ser is not None:
+			self.ser.close()
+			self.ser = None
+
+	def test(self, check_card=True):
+		#boards with native usb don't reset on open and answer right away
+		if not self.wait_ready(PROBE_TIMEOUT):
+			self.ser.close()
+			self.ser.open()		# sometimes when serial port is opened, the arduino resets,so open, then poll until it is back up
+			if not self.wait_ready(READY_TIMEOUT):
+				raise MemCARDuinoError("mcduino communication error, no answer to GETID on "+self.port)
+		self.version = self.get_version()
+		self.batch = self.version >= BATCH_VERSION
+		self.codec.compact = self.version >= COMPACT_VERSION
+		self.detected = False
+
+		self.check_connection(check_card)
+		if check_card and self.auto_capacity:
+			self.detect_capacity()
+
+	def wait_ready(self, timeout):
+		#poll GETID with short reads until the board identifies itself or timeout runs out
+		deadline = time.monotonic() + timeout
+		self.set_timeout(PROBE_TIMEOUT)
+		try:
+			while True:
+				self.ser.reset_input_buffer()
+				self.ser.write(GID)
+				if self.ser.read(6) == b'MCDINO':
+					return True
+				if time.monotonic() >= deadline:
+					return False
+		finally:
+			self.set_timeout(self.timeout)
+
+	def set_timeout(self, timeout):
+		#pyserial reconfigures the port on every change, skip changes too small to matter
+		current = self.ser.timeout
+		if timeout == self.timeout or current is None or abs(timeout - current) > current / 4:
+			if timeout != current:
+				self.ser.timeout = timeout
+
+	def settle(self):
+		#drop input until the link stayed quiet for as long as a response takes
+		quiet = PROBE_TIMEOUT
+		if self.read_latency.samples >= LATENCY_SAMPLES:
+			quiet = self.read_latency.timeout()
+		self.set_timeout(quiet)
+		while self.ser.read(4096):
+			pass
+		self.ser.reset_input_buffer()
+
+	def resync(self):
+		#after a cut short or mangled response the rest of it, and of any response behind it, may still be coming
+		#let it arrive and drop it, then check with GETID that the board takes commands again
+		deadline = time.monotonic() + READY_TIMEOUT
+		try:
+			while True:
+				self.settle()
+				self.ser.write(GID)
+				if self.ser.read(6) == b'MCDINO':
+					return
+				if time.monotonic() >= deadline:
+					raise MemCARDuinoError("mcduino communication error, lost sync with "+self.port)
+		finally:
+			self.set_timeout(self.timeout)
+
+	def get_version(self):
+		self.ser.write(GFV)
+		b = self.ser.read(1)
+		if len(b) != 1:
+			raise MemCARDuinoError("mcduino communication error, no firmware version")
+		return b[0]
+
+	def board_stats(self):
+		#the board's timing counters since the last call, which resets them, None before firmware 0.C
+		if self.version is None or self.version < STATS_VERSION:
+			return None
+		self.ser.write(STATS)
+		count = self.ser.read(1)
+		if len(count) != 1:
+			raise MemCARDuinoError("mcduino communication error, no answer to STATS")
+		data = self.ser.read(count[0] * 4)
+		if len(data) != count[0] * 4:
+			raise MemCARDuinoError("mcduino communication error, STATS cut short")
+		return dict(zip(BOARD_STATS, unpack("<"+str(count[0])+"I", data)))
+
+	def check_connection(self, check_card=True):
+		temp = ""
+		self.log("running mcduino check")
+		#start mcduino verify
+		self.ser.write(GID)
+		temp= self.ser.read(6)
+		if temp != b'MCDINO' :
+			raise MemCARDuinoError("mcduino communication error, got "+repr(temp)+" as identifier (should be \"MCDINO\")")
+		if self.version is not None:
+			self.log("firmware version "+str(self.version >> 4)+"."+format(self.version & 0xF, 'X'))
+
+		#do not check frame reading for pocketstation commands
+		if not check_card:
+			return
+
+		#test first frame
+		self.ser.write(MCR + b"\x00\x01")
+		temp=self.ser.read(129)
+		self.log(temp)
+		b = self.ser.read(1)
+		self.log (b)
+		if (b != b'\x47'):
+			raise MemCARDuinoError("mc read failure, check connections (response byte is "+repr(b)+")")
+		self.log ("")
+
+	def frame_exists(self, address):
+		#one MCR probe, a frame past the end of the card answers BAD SECTOR
+		#a bad checksum still means the card has the frame, link errors are tried again
+		codec = self.codec
+		for attempt in range(self.max_attempts):
+			self.ser.write(codec.encode_read(address))
+			received = self.ser.readinto(codec.frame_view)
+			received += self.ser.readinto(codec.tail)
+			status = codec.tail[1] if received == self.frame_size + 2 else -1
+			if status == 0x47 and codec.tail[0] == (address >> 8) ^ (address & 0xFF) ^ XorElementByteArray(codec.frame):
+				return True
+			if status_name(status) == "BAD SECTOR":
+				return False
+			if status_name(status) == "BAD CHECKSUM":
+				return True
+			self.resync()
+		raise MemCARDuinoError("mcduino communication error, no clean answer probing frame "+str(address))
+
+	def detect_capacity(self):
+		#search for the first frame past the end of the card, end follows it
+		#frames are assumed valid from 0 up to the end, like on every card seen so far
+		last, first_missing = -1, MAX_FRAMES
+		probe = CARD_FRAMES - 1
+		probes = 0
+		while first_missing - last > 1:
+			if self.frame_exists(probe):
+				last = probe
+			else:
+				first_missing = probe
+			probes += 1
+			#cards come in power of two sizes, check the ones in range before bisecting for odd sizes
+			if last >= 0 and (last + 1) & last == 0 and last + 1 < first_missing:
+				probe = last + 1		# last frame of that size reads back, is it the end?
+			elif first_missing == MAX_FRAMES:
+				probe = (1 << last.bit_length()) - 1	# bigger than that, try the next size up
+			elif (first_missing + 1) & first_missing == 0 and (first_missing + 1) // 2 - 1 > last:
+				probe = (first_missing + 1) // 2 - 1	# smaller than that, try the next size down
+			else:
+				probe = (last + first_missing) // 2
+		if last < 0:
+			raise MemCARDuinoError("mc read failure, no frame of the card reads back")
+		self.end = last + 1
+		self.detected = True
+		self.log("card capacity "+str(self.end)+" frames ("+str(self.end * self.frame_size // 1024)+" KiB), "+str(probes)+" probes")
+		return self.end
+
+	# Memory Card Functions
+	def schedule(self, addresses, attempt):
+		#run one pass over addresses, then keep retrying the frames that failed after a backoff
+		#attempt(addresses) tries every address once and returns [(address, status)] of the failures
+		#frames still failing after max_attempts end up in self.errors, the rest of the card never waits on them
+		#returns the addresses given up on
+		attempts = {}
+		given_up = []
+		retries = []	# (due, address)
+		failures = attempt(addresses)
 		while True:
-			tstart = datetime.now()
-			address_bytes =  address.to_bytes(2,byteorder='big') # integer to bytearray(2,bigendian) example 1 --> b'\x00\x01
-			frame = str(address+1)
-			ser.write(MCR)
-			ser.write(address_bytes[0].to_bytes(1, byteorder='big')) # bytearray is bytes but bytearray[i] is int
-			ser.write(address_bytes[1].to_bytes(1, byteorder='big')) # bytearray is bytes but bytearray[i] is int
-			temp = ser.read(frame_size)
-			ser.read(1)
-			b = ser.read(1)
+			now = time.monotonic()
+			for address, status in failures:
+				attempts[address] = attempts.get(address, 0) + 1
+				self.errors.setdefault(address, []).append(status)
+				if attempts[address] < self.max_attempts:
+					retries.append((now + self.backoff(attempts[address]), address))
+					self.log("frame "+str(address+1)+"/"+str(self.end)+" queued for retry "+str(attempts[address])+"/"+str(self.max_attempts - 1))
+				else:
+					self.log("giving up on frame "+str(address+1)+"/"+str(self.end)+" after "+str(attempts[address])+" attempts")
+					given_up.append(address)
+			if not retries:
+				return sorted(given_up)
+			retries.sort()
+			wait = retries[0][0] - time.monotonic()
+			if wait > 0:
+				time.sleep(wait)
+			now = time.monotonic()
+			batch = [address for due, address in retries if due <= now]
+			retries = [(due, address) for due, address in retries if due > now]
+			self.log("\nretrying "+str(len(batch))+" frames...\n")
+			failures = attempt(batch)
+
+	def backoff(self, attempt):
+		#exponential backoff with jitter, a card having a bad moment doesn't get hammered in lockstep
+		delay = min(RETRY_MAX_DELAY, RETRY_DELAY * 2 ** (attempt - 1))
+		return delay / 2 + random.uniform(0, delay / 2)
+
+	def run_length(self, addresses, index):
+		#how many frames from addresses[index] on are consecutive and fit in one MCRN/MCWN request
+		if not self.batch:
+			return 1
+		first = addresses[index]
+		limit = min(len(addresses) - index, BATCH_FRAMES)
+		count = 1
+		while count < limit and addresses[index + count] == first + count:
+			count += 1
+		return count
+
+	def read_range(self, addresses, store, buffer_for=None):
+		#read every frame in addresses, store(address, data) receives the good ones
+		#failed frames are retried after the rest, so frames may arrive out of order
+		#buffer_for(address) can hand out the 128 byte buffer a frame is received straight into
+		#frames that never read back never reach store, they are left in self.unread
+		passed = []
+		def attempt(addresses):
+			good, failures = self.read_pass(addresses, store, buffer_for)
+			passed.append(good)
+			return failures
+		self.unread = []
+		try:
+			self.unread = self.schedule(list(addresses), attempt)
+		finally:
+			self.set_timeout(self.timeout)
+		return sum(passed)
+
+	def read_pass(self, addresses, store, buffer_for=None):
+		#store gets the codec's frame buffer unless buffer_for handed one out, copy it to keep it
+		ser = self.ser
+		codec = self.codec
+		profile = self.profile
+		frame_size = self.frame_size
+		end = self.end
+		passed = 0
+		failures = []
+		if profile is not None:
+			profile.start()
+		pending = deque()	# [index, frames, tstart] of every request sent but not yet fully answered, oldest first
+		queued = 0			# frames requested but not received yet
+		index = 0
+		next_index = 0
+		last_end = None
+		while index < len(addresses):
+			#queue requests ahead so the link never sits idle waiting for a round trip
+			while next_index < len(addresses) and len(pending) < self.depth and queued < BATCH_FRAMES:
+				count = self.run_length(addresses, next_index)
+				pending.append([next_index, count, datetime.now()])
+				if count > 1 or codec.compact:
+					ser.write(codec.encode_batch(MCRC if codec.compact else MCRN, addresses[next_index], count))
+				else:
+					ser.write(codec.encode_read(addresses[next_index]))
+				next_index += count
+				queued += count
+			#responses come back in the order requests were sent, a MCRN answers frame by frame
+			request = pending[0]
+			index, tstart = request[0], request[2]
+			request[1] -= 1
+			queued -= 1
+			if request[1] == 0:
+				pending.popleft()
+			address = addresses[index]
+			temp = codec.frame_view if buffer_for is None else buffer_for(address)
+			timeout = self.read_latency.timeout()
+			self.set_timeout(timeout)
+			received = codec.receive(ser, temp)
+			if received == 0 and timeout < self.timeout:
+				#not a byte of it in time, one more timeout covers a hiccup, a link that really got slower is left to expire()
+				received = codec.receive(ser, temp)
+			if received >= 0:
+				received += ser.readinto(codec.tail)
 			tend = datetime.now()
 			tPrint=tend-tstart
-			#str128zeros = "\x00"*128
-			#print(ByteToHex(b))
-			if(b == b'\x47'):
-				f.write(temp)
-				print("OK at frame "+frame+"/"+str(end)+"  Address:"+ByteToHex(address_bytes)+" TimeTaken:"+str(tPrint))
+			index += 1
+			request[0] = index
+			request[2] = tend
+			#time since this response was next in line, queued requests don't count twice
+			waited = tend - (tstart if last_end is None or tstart > last_end else last_end)
+			last_end = tend
+			status = codec.tail[1] if received == frame_size + 2 else -1
+			if profile is not None:
+				profile.frame("read", address, status == 0x47)
+			#the card sends MSB xor LSB xor data, a mismatch means the frame got mangled on the serial link
+			if(received < 0):
+				error = "LINK ENCODING"
+			elif(status == 0x47 and codec.tail[0] != (address >> 8) ^ (address & 0xFF) ^ XorElementByteArray(temp)):
+				error = "LINK CHECKSUM"
+			elif(status == 0x47):
+				self.read_latency.update(waited.total_seconds())
+				store(address, temp)
+				if self.verbose:
+					self.log("OK at frame "+str(address+1)+"/"+str(end)+"  Address:"+format(address,'02x')+" TimeTaken:"+str(tPrint))
 				passed += 1
-				break
-			elif(b == b'\x4E') :
-				print("BAD CHECKSUM at frame "+frame+"/"+str(end)+"  Address:"+ByteToHex(address_bytes)+" TimeTaken:"+str(tPrint))
-				f.write(b"\x00"*128)
-			elif(b == b'\xFF'):
-				print("BAD SECTOR at frame "+frame+"/"+str(end)+"  Address:"+ByteToHex(address_bytes)+" TimeTaken:"+str(tPrint))
-				f.write(b"\x00"*128)
+				continue
 			else:
-				print("UNKNOWN ERROR at frame "+frame+"/"+str(end)+"  Address:"+ByteToHex(address_bytes)+" TimeTaken:"+str(tPrint))  # WTF?
-				f.write(b"\x00"*128)				
-			print("retrying frame "+frame+"/"+str(end)+"...\n")
-			time.sleep(0.5)
-	result(passed)
-
-
-def memcard_write(file):
-	f = file
-	#temp = ""
-	print("writing data to memory card...\n")
-	passed = 0
-	for address in range(start, end):
-		while True:
+				error = status_name(status)
+			failures.append((address, error))
+			if error in CARD_ERRORS:
+				#the response was whole, the ones behind it are still in line
+				self.card_errors += 1
+				self.log(error+" at frame "+str(address+1)+"/"+str(end)+"  Address:"+format(address,'02x')+" TimeTaken:"+str(tPrint))
+				continue
+			self.link_errors += 1
+			self.log(error+" at frame "+str(address+1)+"/"+str(end)+"  Address:"+format(address,'02x')+" TimeTaken:"+str(tPrint))
+			if 0 <= received < frame_size + 2:
+				self.read_latency.expire()
+			#requests behind the failed one are sent again once the link is back in sync
+			pending.clear()
+			queued = 0
+			self.resync()
+			next_index = index
+			last_end = None
+		return passed, failures
+
+	def read_frame(self, address):
+		frames = {}
+		def store(address, data):
+			frames[address] = bytes(data)
+		self.read_range([address], store)
+		return frames.get(address)
+
+	def write_range(self, addresses, data_for, written=None):
+		#write every frame in addresses with the 128 bytes data_for(address) returns, failed frames are retried after the rest
+		#written(address) is told about every frame the card confirmed
+		#returns the number of frames written and the time spent writing them
+		passed = []
+		tTotal = []
+		def attempt(addresses):
+			good, tWrite, failures = self.write_pass(addresses, data_for, written)
+			passed.append(good)
+			tTotal.append(tWrite)
+			return failures
+		try:
+			self.schedule(list(addresses), attempt)
+		finally:
+			self.set_timeout(self.timeout)
+		return sum(passed), sum(tTotal, timedelta())
+
+	def write_pass(self, addresses, data_for, written=None):
+		ser = self.ser
+		codec = self.codec
+		profile = self.profile
+		end = self.end
+		passed = 0
+		failures = []
+		tTotal = timedelta()
+		if profile is not None:
+			profile.start()
+		batched = 0		# frames the open MCWN request still expects
+		for index, address in enumerate(addresses):
+			request = codec.encode_write(address, data_for(address))
+			timeout = self.write_latency.timeout()
+			self.set_timeout(timeout)
 			tstart = datetime.now()
-			address_bytes = address.to_bytes(2,byteorder='big') # integer to bytearray(2,bigendian) example 1 --> b'\x00\x01
-			frame = str(address+1)
-			data_block = f.read(frame_size)
-			chk = b''
-			chk = address_bytes[1]^address_bytes[0]^XorElementByteArray(data_block)
-			ser.write(MCW)
-			ser.write(address_bytes[0].to_bytes(1, byteorder='big')) # bytearray is bytes but bytearray[i] is int
-			ser.write(address_bytes[1].to_bytes(1, byteorder='big')) # bytearray is bytes but bytearray[i] is int
-			ser.write(data_block)
-			ser.write(chk.to_bytes(1,byteorder='big'))	
-			b = ser.read(1)
+			if batched == 0:
+				count = self.run_length(addresses, index)
+				if count > 1 or codec.compact:
+					ser.write(codec.encode_batch(MCWC if codec.compact else MCWN, address, count))
+					batched = count
+			if batched:
+				#the next frame only goes out after the status of the last one, it would overflow the board's serial buffer
+				ser.write(codec.encode_compact() if codec.compact else codec.write_data)
+				batched -= 1
+			else:
+				ser.write(request)
+			received = ser.readinto(codec.status)
+			if received == 0 and timeout < self.timeout:
+				#no status in time, one more timeout covers a hiccup, a link that really got slower is left to expire()
+				received = ser.readinto(codec.status)
+			status = codec.status[0] if received == 1 else -1
+			if profile is not None:
+				profile.frame("write", address, status == 0x47)
 			tend = datetime.now()
 			tPrint=tend-tstart
-			if(b == b"\x47"):
-				print("bytereceive:"+ ByteToHex(b) +"  OK at frame "+frame+"/"+str(end)+"  Address:"+ByteToHex(address_bytes)+"  CHECKSUM:"+ByteToHex(chk.to_bytes(1,byteorder='big'))+" TimeTaken:"+str(tPrint))
+			tTotal += tPrint
+			if(status == 0x47):
+				self.write_latency.update(tPrint.total_seconds())
+				if self.verbose:
+					self.log("bytereceive:47  OK at frame "+str(address+1)+"/"+str(end)+"  Address:"+format(address,'02x')+"  CHECKSUM:"+format(codec.checksum(),'02x')+" TimeTaken:"+str(tPrint))
 				passed += 1
-				break
-			elif(b == b"\x4E"):
-				print("bytereceive:"+ ByteToHex(b) +"  BAD CHECKSUM at frame "+frame+"/"+str(end)+"  Address:"+ByteToHex(address_bytes)+"  CHECKSUM:"+ByteToHex(chk.to_bytes(1,byteorder='big'))+" TimeTaken:"+str(tPrint))
-			elif(b == b"\xFF"):
-				print("bytereceive:"+ ByteToHex(b) +"  BAD SECTOR at frame "+frame+"/"+str(end)+"  Address:"+ByteToHex(address_bytes)+"  CHECKSUM:"+ByteToHex(chk.to_bytes(1,byteorder='big'))+" TimeTaken:"+str(tPrint))
+				if written:
+					written(address)
+			else:
+				self.log("bytereceive:"+format(max(status, 0),'02x')+"  "+status_name(status)+" at frame "+str(address+1)+"/"+str(end)+"  Address:"+format(address,'02x')+"  CHECKSUM:"+format(codec.checksum(),'02x')+" TimeTaken:"+str(tPrint))
+				failures.append((address, status_name(status)))
+				if status_name(status) not in CARD_ERRORS:
+					#no status or garbage, the board may still be busy with the request
+					if status == -1:
+						self.write_latency.expire()
+					#the board drops the rest of a MCWN batch once the data stops, the next frame starts a new one
+					self.resync()
+					batched = 0
+		return passed, tTotal, failures
+
+	def write_frame(self, address, data):
+		passed, tWrite = self.write_range([address], lambda address: data)
+		return passed == 1
+
+	def read(self, file, checkpoint=None, resume=False):
+		#frames are received straight into a mapped image of the output file at address * frame_size
+		#with a checkpoint path the frames read so far are recorded there, resume only reads the ones missing
+		f = file
+		start = self.start
+		frame_size = self.frame_size
+		count = self.end - start
+		mapped = map_image(f, count * frame_size)
+		image = mapped if mapped is not None else bytearray(count * frame_size)
+		view = memoryview(image)
+		progress = None
+		if checkpoint is not None and mapped is not None:
+			progress = Checkpoint(checkpoint, "READ", start, self.end, flush=mapped.flush, log=self.log)
+			if resume and progress.load():
+				self.log("resuming, "+str(count - len(progress.missing()))+" frames already read\n")
+		valid = progress.done if progress is not None else bytearray(count)	# frame validity bitmap, set once a frame reads back with a good status
+		def buffer_for(address):
+			return view[(address - start) * frame_size:(address - start + 1) * frame_size]
+		def store(address, data):
+			if progress is not None:
+				progress.mark(address)
+			else:
+				valid[address - start] = 1
+
+		self.log("reading data from memory card...\n")
+		addresses = [address for address in range(start, self.end) if not valid[address - start]]
+		passed = count - len(addresses) + self.read_range(addresses, store, buffer_for)
+
+		#frames that never read back are zero filled, not left with whatever a failed attempt received
+		for index in range(count):
+			if not valid[index]:
+				view[index * frame_size:(index + 1) * frame_size] = bytes(frame_size)
+		view.release()
+		if progress is not None:
+			if passed == count:
+				progress.remove()
 			else:
-				print ("bytereceive:"+ ByteToHex(b) +"  UNKNOWN ERROR at frame "+frame+"/"+str(end)+"  Address:"+ByteToHex(address_bytes)+"  CHECKSUM:"+ByteToHex(chk.to_bytes(1,byteorder='big'))+" TimeTaken:"+str(tPrint))   # WTF?
-			print("retrying frame "+frame+"/"+str(end)+"...\n")
-			time.sleep(0.5)
-	result(passed)
-	
-def memcard_format():
-	#temp = ""
-	print("formatting memory card...\n")
-	passed = 0
-	for address in range(start, end):
-		tstart = datetime.now()
-		frame = str(address+1)
-		address_bytes = address.to_bytes(2,byteorder='big') # integer to bytearray(2,bigendian) example 1 --> b'\x00\x01
-		if (address==0):
-			data_block = b"MC" #"MC"
-			data_block = data_block+(b"\x00"*125) #125 blanks
-			data_block = data_block+b"\x0E" #checksum
+				progress.save()
+		if mapped is not None:
+			mapped.flush()
+			mapped.close()
 		else:
-			data_block = b"\x00"*128 	
-		chk =  b""
-		chk = ((address_bytes[1])^(address_bytes[0])^XorElementByteArray(data_block))
-		ser.write(MCW)
-		ser.write(address_bytes[0].to_bytes(1,'big')) # bytearray is bytes but bytearray[i] is int
-		ser.write(address_bytes[1].to_bytes(1,'big')) # bytearray is bytes but bytearray[i] is int
-		ser.write(data_block)
-		ser.write(chk.to_bytes(1,byteorder='big'))
-		b = ser.read(1)
-		tend = datetime.now()
-		tPrint=tend-tstart
-		if(b == b"\x47"):
-			print("OK at frame "+frame+"/"+str(end)+"  Address:"+ByteToHex(address_bytes)+" TimeTaken:"+str(tPrint))
-			passed += 1
-		elif(b == b"\x4E"):
-			print("BAD CHECKSUM at frame "+frame+"/"+str(end)+"  Address:"+ByteToHex(address_bytes)+" TimeTaken:"+str(tPrint))
-		elif(b == b"\xFF"):
-			print("BAD SECTOR at frame "+frame+"/"+str(end)+"  Address:"+ByteToHex(address_bytes)+" TimeTaken:"+str(tPrint))
+			f.write(image)
+		return self.result("READ", passed, count)
+
+	def read_sparse(self, file):
+		f = file
+		frame_size = self.frame_size
+		end = self.end
+		image = bytearray(end * frame_size)	# free blocks stay zero filled
+		view = memoryview(image)
+		valid = bytearray(end)
+		def buffer_for(address):
+			return view[address * frame_size:(address + 1) * frame_size]
+		def store(address, data):
+			valid[address] = 1
+
+		self.log("reading directory from memory card...\n")
+		passed = self.read_range(range(0, min(FRAMES_PER_BLOCK, end)), store, buffer_for)
+		directory = {}
+		for block in range(1, DIRECTORY_FRAMES + 1):
+			directory[block] = image[block * frame_size:(block + 1) * frame_size]
+
+		#only allocated blocks hold anything worth reading, frames past the last directory block are always read
+		addresses = [address for block in sorted(allocated_blocks(directory)) for address in block_frames(block) if address < end]
+		addresses += range(max((DIRECTORY_FRAMES + 1) * FRAMES_PER_BLOCK, FRAMES_PER_BLOCK), end)
+		self.log("\nreading "+str(len(addresses))+" frames of allocated blocks...\n")
+		passed += self.read_range(addresses, store, buffer_for)
+		skipped = max(end - FRAMES_PER_BLOCK, 0) - len(addresses)
+
+		for address in range(end):
+			if not valid[address]:
+				view[address * frame_size:(address + 1) * frame_size] = bytes(frame_size)
+		view.release()
+		f.write(image[self.start * frame_size:end * frame_size])
+		self.log("\nskipped "+str(skipped)+" frames of free blocks")
+		return self.result("READ", passed + skipped, end - self.start)
+
+	def write(self, file, checkpoint=None, resume=False):
+		#with a checkpoint path the frames written so far are recorded there, resume only writes the ones missing
+		f = file
+		start = self.start
+		frame_size = self.frame_size
+		count = self.end - start
+		image = f.read(count * frame_size)
+		progress = None
+		addresses = range(start, self.end)
+		if checkpoint is not None:
+			progress = Checkpoint(checkpoint, "WRITE", start, self.end, digest=hashlib.sha1(image).hexdigest(), log=self.log)
+			if resume and progress.load():
+				addresses = progress.missing()
+				self.log("resuming, "+str(count - len(addresses))+" frames already written\n")
+		self.log("writing data to memory card...\n")
+		passed, tWrite = self.write_range(addresses, lambda address: image[(address - start) * frame_size:(address - start + 1) * frame_size], progress.mark if progress is not None else None)
+		passed += count - len(addresses)
+		if progress is not None:
+			if passed == count:
+				progress.remove()
+			else:
+				progress.save()
+		return self.result("WRITE", passed, count)
+
+	def write_diff(self, file, cache=""):
+		f = file
+		start = self.start
+		end = self.end
+		frame_size = self.frame_size
+		image = f.read((end - start) * frame_size)
+		card = bytearray(end * frame_size)
+		unread = set()
+
+		#what is on the card right now, from a previous dump if there is one
+		if cache != "" and os.path.isfile(cache):
+			self.log("comparing against cached card image "+cache+"...\n")
+			with open(cache, 'rb') as c:
+				cached = c.read(end * frame_size)
+			card[0:len(cached)] = cached
 		else:
-			print("UNKNOWN ERROR at frame "+frame+"/"+str(end)+"  Address:"+ByteToHex(address_bytes)+" TimeTaken:"+str(tPrint))   # WTF?
-				
-	result(passed)
-		
-def no_pocketstation():
-	print("pocketstation not found")
+			self.log("reading data from memory card to compare...\n")
+			def store(address, data):
+				card[address * frame_size:(address + 1) * frame_size] = data
+			self.read_range(range(start, end), store)
+			unread = set(self.unread)
 
-def ps_info():
-	print("pocketstation info:")
-	ser.write(PSINFO)
-	b = ser.read(1)
+		#a frame that couldn't be read may hold anything, it is written like a changed one
+		def data_for(address):
+			return image[(address - start) * frame_size:(address - start + 1) * frame_size]
+		changed = [address for address in range(start, end) if address in unread or data_for(address) != card[address * frame_size:(address + 1) * frame_size]]
 
-	if(b[0] != 0x12):
-		no_pocketstation()
-		return
+		self.log("\nwriting "+str(len(changed))+" changed frames to memory card...\n")
+		written, tWrite = self.write_range(changed, data_for)
+		skipped = (end - start) - len(changed)
 
-	b = ser.read(0x12)
+		#the card now matches the image, keep the cache in step with it
+		if cache != "" and written == len(changed):
+			for address in changed:
+				card[address * frame_size:(address + 1) * frame_size] = data_for(address)
+			with open(cache, 'wb') as c:
+				c.write(card)
 
-	psserial = b[6] | b[7] << 8 | b[8] << 16
+		self.log("\nskipped "+str(skipped)+" unchanged frames")
+		if written > 0:
+			self.log("time saved: ~"+str(tWrite / written * skipped))
+		return self.result("WRITE", written + skipped)
+
+	def read_directory(self):
+		#directory frames 1-15 by block number
+		directory = {}
+		def store(address, data):
+			directory[address] = bytearray(data)
+		self.read_range(range(1, DIRECTORY_FRAMES + 1), store)
+		return directory
+
+	def format(self):
+		self.log("formatting memory card...\n")
+		passed, tWrite = self.write_range(range(self.start, self.end), lambda address: header_frame() if address == 0 else b"\x00"*128)
+		return self.result("FORMAT", passed)
+
+	def quick_format(self, clear=False):
+		#an empty card is only a header and 15 free directory frames, save data is left where it is
+		directory = {}
+		if clear:
+			self.log("reading directory from memory card...\n")
+			directory = self.read_directory()
+			if self.unread:
+				raise MemCARDuinoError("mc read failure, directory frames "+", ".join(str(address) for address in self.unread)+" could not be read, blocks to clear unknown")
+
+		self.log("quick formatting memory card...\n")
+		frames = {0: header_frame()}
+		for address in range(1, DIRECTORY_FRAMES + 1):
+			frames[address] = free_directory_frame()
+
+		#optionally wipe the blocks that held (or still hold deleted) saves
+		if clear:
+			for block, data in directory.items():
+				if data[0] in (BLOCK_FIRST, BLOCK_MIDDLE, BLOCK_LAST, BLOCK_DELETED_FIRST, BLOCK_DELETED_MIDDLE, BLOCK_DELETED_LAST):
+					for address in block_frames(block):
+						if address < self.end:
+							frames[address] = b"\x00"*128
 
-	print("serial:", end = " ")
-	print(chr(b[9]), end = "")
-	print("%08d" % (psserial))
-
-	print("date:", end = " ")
-	print(format(b[13], 'x'), end = "")
-	print(format(b[12], 'x'), end = "/")
-	print(format(b[11], 'x'), end = "/")
-	print(format(b[10], 'x'))
-
-	print("time:", end = " ")
-	print(format(b[16], 'x'), end = ":")
-	print(format(b[15], 'x'))
-
-	print("day:", end = " ")
-
-	if(b[17] == 1):
-		print("sunday")
-	elif(b[17] == 2):
-		print("monday")
-	elif(b[17] == 3):
-		print("tuesday")
-	elif(b[17] == 4):
-		print("wednesday")
-	elif(b[17] == 5):
-		print("thursday")
-	elif(b[17] == 6):	
-		print("friday")
-	elif(b[17] == 7):
-		print("saturday")
-
-def ps_bios(file):
-	print("dump pocketstation bios:")
-	f = file
-	passed = 0
-	checksum = 0
-
-	for address in range(0, 128):
-		tstart = datetime.now()
-		frame = str(address+1)
-		ser.write(PSBIOS)
-		ser.write(address.to_bytes(1))
+		passed, tWrite = self.write_range(sorted(frames), frames.get)
+		return self.result("QUICKFORMAT", passed, len(frames))
+
+	def list_directory(self):
+		#everything about the saves is in the header block's first 16 frames
+		frames = {}
+		def store(address, data):
+			frames[address] = bytearray(data)
+		self.log("reading directory from memory card...\n")
+		self.read_range(range(0, DIRECTORY_FRAMES + 1), store)
+		directory = {block: frames[block] for block in range(1, DIRECTORY_FRAMES + 1) if block in frames}
+
+		#a directory frame that never read back lists its slot as unreadable
+		slots = []
+		for block in range(1, DIRECTORY_FRAMES + 1):
+			if block not in directory:
+				slots.append({"slot": block, "state": "unreadable", "region": "", "product": "", "identifier": "",
+					"size": 0, "blocks": 0, "chain": [], "checksum_ok": None})
+				continue
+			entry = directory_entry(directory[block])
+			chain = link_chain(directory, block) if entry["state"] == BLOCK_FIRST else []
+			slots.append({
+				"slot": block,
+				"state": STATE_NAMES.get(entry["state"], "unknown (" + format(entry["state"], '02x') + ")"),
+				"region": entry["name"][0:2],
+				"product": entry["name"][2:12],
+				"identifier": entry["name"][12:],
+				"size": entry["size"],
+				"blocks": len(chain),
+				"chain": chain,
+				"checksum_ok": entry["valid"],
+			})
+		return {"formatted": frames[0][0:2] == b"MC" if 0 in frames else None, "slots": slots}
+
+	def export_save(self, file, slot):
+		#save a single save as .mcs: its first directory frame followed by the data of every block in its chain
+		f = file
+		self.log("reading directory from memory card...\n")
+		directory = self.read_directory()
+		if slot in self.unread:
+			raise MemCARDuinoError("mc read failure, directory frame of slot "+str(slot)+" could not be read")
+		if slot not in directory or directory_entry(directory[slot])["state"] != BLOCK_FIRST:
+			self.log("\nerror: no save starts at slot "+str(slot)+", saves on this card:")
+			for block, chain in list_saves(directory):
+				self.log("slot "+str(block)+": "+directory_entry(directory[block])["name"]+" ("+str(len(chain))+" blocks)")
+			return False
+		chain = link_chain(directory, slot)
+		if directory_entry(directory[chain[-1]])["next"] in self.unread:
+			raise MemCARDuinoError("mc read failure, directory frame of slot "+str(directory_entry(directory[chain[-1]])["next"])+" in the save's chain could not be read")
+		self.log("\nexporting "+directory_entry(directory[slot])["name"]+" ("+str(len(chain))+" blocks)...\n")
+
+		data = {}
+		def store(address, data_block):
+			data[address] = bytes(data_block)
+		addresses = [address for block in chain for address in block_frames(block)]
+		passed = self.read_range(addresses, store)
+		if self.unread:
+			raise MemCARDuinoError("mc read failure, frames "+", ".join(str(address) for address in self.unread)+" of the save could not be read, nothing exported")
+
+		f.write(directory[slot])
+		for address in addresses:
+			f.write(data[address])
+		return self.result("EXPORT", passed, len(addresses))
+
+	def import_save(self, file):
+		#write a .mcs save into free blocks, data first so an interrupted import leaves the directory untouched
+		f = file
+		frame_size = self.frame_size
+		header = f.read(frame_size)
+		save = f.read()
+		count = len(save) // (FRAMES_PER_BLOCK * frame_size)
+		if len(header) < frame_size or count == 0 or len(save) % (FRAMES_PER_BLOCK * frame_size) != 0:
+			self.log("error: not a .mcs save file")
+			return False
+
+		self.log("reading directory from memory card...\n")
+		directory = self.read_directory()
+		free = [block for block in sorted(directory) if directory_entry(directory[block])["state"] == BLOCK_FREE]
+		if len(free) < count:
+			self.log("\nerror: save needs "+str(count)+" blocks, only "+str(len(free))+" free")
+			return False
+		chain = free[0:count]
+
+		frames = {}
+		for index, block in enumerate(chain):
+			for offset, address in enumerate(block_frames(block)):
+				position = (index * FRAMES_PER_BLOCK + offset) * frame_size
+				frames[address] = save[position:position + frame_size]
+
+		#first entry keeps the save's name and size, linked entries only carry state and next block
+		for index, block in enumerate(chain):
+			if index == 0:
+				entry = bytearray(header)
+				entry[0] = BLOCK_FIRST
+				if int.from_bytes(entry[4:8], byteorder='little') == 0:
+					entry[4:8] = (count * FRAMES_PER_BLOCK * frame_size).to_bytes(4, byteorder='little')
+			else:
+				entry = bytearray(128)
+				entry[0] = BLOCK_LAST if index == count - 1 else BLOCK_MIDDLE
+			if index == count - 1:
+				entry[8:10] = b"\xFF\xFF"
+			else:
+				entry[8:10] = (chain[index + 1] - 1).to_bytes(2, byteorder='little')
+			frames[block] = frame_checksum(entry)
+
+		self.log("\nimporting "+directory_entry(frames[chain[0]])["name"]+" to slot "+str(chain[0])+" ("+str(count)+" blocks)...\n")
+		data = [address for address in sorted(frames) if address > DIRECTORY_FRAMES]
+		passed, tWrite = self.write_range(data, frames.get)
+		#failed frames are only retried after the rest, so the directory waits until every data frame made it
+		if passed < len(data):
+			self.log("\nerror: "+str(len(data) - passed)+" data frames failed, directory left untouched")
+			return self.result("IMPORT", passed, len(data) + len(chain))
+		written, tWrite = self.write_range(chain, frames.get)
+		return self.result("IMPORT", passed + written, len(data) + len(chain))
+
+	def ps_info(self):
+		#serial number and clock of the pocketstation, None if there is no pocketstation
+		self.ser.write(PSINFO)
+		b = self.ser.read(1)
+
+		if(len(b) != 1 or b[0] != 0x12):
+			return None
+
+		return ps_info_fields(self.ser.read(0x12))
+
+	def ps_bios(self, file, cache="", trust=False):
+		#dump the pocketstation bios to file, returns its checksum
+		#chunks are requested a few ahead, failed ones are retried after the rest and land at their own offset
+		#cache is a directory of known images the finished dump is checked against
+		#with trust, once BIOS_IDENTIFY_CHUNKS chunks matched only one of them the rest comes from it unread,
+		#a bios that only differs from it in chunks that weren't read is taken for it
+		image = bytearray(BIOS_SIZE)
+		done = bytearray(BIOS_CHUNKS)
+		cached = load_bios_cache(cache) if cache else {}
+		known = dict(cached)
+		matched = 0
+		#every 8th chunk first, the first few already sample the whole bios
+		order = sorted(range(BIOS_CHUNKS), key=lambda chunk: (chunk % 8, chunk))
+		def identified():
+			return trust and len(known) == 1 and matched >= BIOS_IDENTIFY_CHUNKS
+		def store(chunk, data):
+			nonlocal matched
+			image[chunk * BIOS_CHUNK:(chunk + 1) * BIOS_CHUNK] = data
+			done[chunk] = 1
+			for checksum in [checksum for checksum, bios in known.items() if bios[chunk * BIOS_CHUNK:(chunk + 1) * BIOS_CHUNK] != data]:
+				del known[checksum]
+			matched += 1
+			return not identified()
+
+		remaining = order
+		for attempt in range(1, self.max_attempts + 1):
+			if attempt > 1:
+				time.sleep(self.backoff(attempt - 1))
+				self.log("\nretrying "+str(len(remaining))+" bios chunks...\n")
+			remaining = self.bios_pass(remaining, store, probe=attempt == 1)
+			if not remaining or identified():
+				break
+
+		if identified():
+			checksum, bios = next(iter(known.items()))
+			self.log("matches cached bios "+format(checksum, '08x')+" after "+str(matched)+" chunks, "+str(BIOS_CHUNKS - sum(done))+" chunks taken from the cache")
+			image[:] = bios
+			remaining = []
+		elif cached and not remaining:
+			#the whole bios was read, say how far it is from the closest cached one if it matches none
+			closest = min(cached, key=lambda checksum: sum(1 for chunk in range(BIOS_CHUNKS) if cached[checksum][chunk * BIOS_CHUNK:(chunk + 1) * BIOS_CHUNK] != image[chunk * BIOS_CHUNK:(chunk + 1) * BIOS_CHUNK]))
+			differing = [chunk for chunk in range(BIOS_CHUNKS) if cached[closest][chunk * BIOS_CHUNK:(chunk + 1) * BIOS_CHUNK] != image[chunk * BIOS_CHUNK:(chunk + 1) * BIOS_CHUNK]]
+			if differing:
+				self.log("warning: differs from cached bios "+format(closest, '08x')+" in "+str(len(differing))+" chunks ("+", ".join(str(chunk) for chunk in differing[0:8])+(", ..." if len(differing) > 8 else "")+")")
+			else:
+				self.log("matches cached bios "+format(closest, '08x'))
+		file.write(image)
+		checksum = bios_checksum(image)
+		self.log("checksum: %08x" % (checksum))
+
+		self.log(bios_release(checksum))
+		if remaining:
+			raise MemCARDuinoError(str(len(remaining))+" bios chunks failed after "+str(self.max_attempts)+" attempts, saved as \\x00")
+		if cache and checksum in BIOS_RELEASES:
+			save_bios(cache, image, checksum)
+		return checksum
+
+	def bios_pass(self, chunks, store, probe=False):
+		#request every chunk once, returns the ones that failed
+		#store(chunk, data) gets the good ones and returns False once no more are needed
+		#with probe the first request goes alone, a missing pocketstation answers it with a single byte
+		ser = self.ser
+		depth = max(self.depth, BIOS_DEPTH)
+		header = bytearray(2)	# parameter and data size
+		header_view = memoryview(header)
+		data = bytearray(BIOS_CHUNK)
+		status = bytearray(1)
+		failed = []
+		if self.profile is not None:
+			self.profile.start()
+		pending = deque()	# (index, tstart) of every request sent but not yet answered, oldest first
+		next_index = 0
+		wanted = True
+		while pending or (wanted and next_index < len(chunks)):
+			while wanted and next_index < len(chunks) and len(pending) < (1 if probe else depth):
+				pending.append((next_index, datetime.now()))
+				ser.write(PSBIOS + bytes((chunks[next_index],)))
+				next_index += 1
+			index, tstart = pending.popleft()
+			chunk = chunks[index]
+			received = ser.readinto(header_view[:1])
+			if received == 1 and header[0] == 0x05:
+				received += ser.readinto(header_view[1:])
+				if received == 2 and header[1] == 0x80:
+					received += ser.readinto(data)
+					received += ser.readinto(status)
+			tPrint = datetime.now() - tstart
+			if self.profile is not None:
+				self.profile.frame("bios", chunk, received == BIOS_CHUNK + 3 and status[0] == 0x47)
+			if received == BIOS_CHUNK + 3 and status[0] == 0x47:
+				probe = False
+				self.log("OK at chunk "+str(chunk+1)+"/"+str(BIOS_CHUNKS)+" TimeTaken:"+str(tPrint))
+				wanted = store(chunk, data) and wanted
+				continue
+			if probe and received == 1 and header[0] != 0x05:
+				self.resync()
+				raise MemCARDuinoError("pocketstation not found")
+			self.link_errors += 1
+			self.log("LINK ERROR at chunk "+str(chunk+1)+"/"+str(BIOS_CHUNKS)+" TimeTaken:"+str(tPrint))
+			#requests behind the failed one are sent again once the link is back in sync
+			failed.append(chunk)
+			pending.clear()
+			self.resync()
+			next_index = index + 1
+		return failed
+
+	def ps_time(self, now=None):
+		#set the pocketstation clock, to the current time by default
+		if now is None:
+			now = datetime.now()
+
+		self.ser.write(PSTIME)
 
 		#parameter check
-		b = ser.read(1)
-		if(b[0] != 0x5):
-			no_pocketstation()
-			sys.exit()
+		b = self.ser.read(1)
+		if(len(b) != 1 or b[0] != 0x0):
+			return False
 
 		#datasize check
-		b = ser.read(1)
-		if(b[0] != 0x80):
-			no_pocketstation()
-			sys.exit()
+		b = self.ser.read(1)
+		if(len(b) != 1 or b[0] != 0x8):
+			return False
 
-		#get bios data
-		temp = ser.read(128)
+		#push data to pocketstation, it answers with a status byte once the clock is set
+		self.ser.write(ps_time_data(now))
+		return self.ser.read(1) == b'\x47'
 
-		#calculate checksum
-		for index in range(0, 32):
-			checksum += temp[index*4] | temp[index*4 + 1] << 8| temp[index*4 + 2] << 16 | temp[index*4 + 3] << 24
+	def result(self, mode, passed, total=None):
+		if total is None:
+			total = self.end
+		self.log("\n\n\n")
+		#every frame that needed more than one attempt, whether it made it in the end or not
+		if self.errors:
+			self.log("frame errors:")
+			for address in sorted(self.errors):
+				statuses = self.errors[address]
+				outcome = "failed" if len(statuses) >= self.max_attempts else "recovered after "+str(len(statuses) + 1)+" attempts"
+				self.log("  frame "+str(address+1)+"  Address:"+ByteToHex(address.to_bytes(2,byteorder='big'))+"  "+", ".join(statuses)+"  "+outcome)
+			self.log("")
+			self.errors = {}
+		self.last_result = {"mode": mode, "frames": passed, "failed": total - passed, "link_errors": self.link_errors, "card_errors": self.card_errors}
+		if self.link_errors or self.card_errors:
+			self.log("link errors: "+str(self.link_errors)+"  card errors: "+str(self.card_errors)+"\n")
+			self.link_errors = 0
+			self.card_errors = 0
+		if(passed == total):
+			self.log("SUCCESS")
+		else:
+			self.log(mode + " ERROR: "+str(total-passed)+" failed\n")
+		return passed == total
 
-		b = ser.read(1)
-		tend = datetime.now()
-		tPrint=tend-tstart
+# Help Functions
+def help():
+	print("memcarduino usage:")
+	print("memcarduino.py -p,--port <serial port> , -r,--read <output file> OR -w,--write <input file> OR -f,--format OR --quick-format OR --list OR --psinfo OR --pstime OR --psbios <output file>, [-c,--capacity <capacity>] , [-b,--bitrate <bitrate:bps>]")
+	print("<serial port> accepts COM port names, or for linux, file references (/dev/tty[...] or others)")
+	print("              termios:/dev/tty[...] drives the port through termios with low latency reads (linux, macos)")
+	print("              tcp://host:port connects to a raw tcp serial bridge (ser2net), rfc2217://host:port to an rfc2217 one")
+	print("several ports (-p repeated, comma separated or a glob like \"/dev/ttyACM*\") read, write, format or list all cards at once")
+	print("with several ports the port name goes before the extension of <output file> (card.mcr -> card-ttyACM0.mcr), or replaces {device} in it")
+	print("<output file> read from memory card and save to file")
+	print("<input file> read from file and write to memory card (accepts both windows and linux file URI's)")
+	print("<capacyty> sets memory card capacity [frames] *1 frame = 128 B* (default 1024 frames), auto probes each card for it")
+	print("<bitrate> sets bitrate on serial port (default 115200 bps)")
+	print("--list prints the saves on the card from its directory, [--json] as json")
+	print("--export <output file> --slot <slot> saves a single save as .mcs, slot is the block the save starts at (1-15)")
+	print("--import <input file> writes a .mcs save to the first free blocks of the card")
+	print("--sparse only reads blocks in use by saves, free blocks are saved as \\x00")
+	print("--diff only writes frames that differ from the card, [--cache <image file>] compares against a previous dump instead of reading the card and keeps it up to date")
+	print("--resume continues an interrupted read or write, frames confirmed so far are kept in <file>.ckpt")
+	print("--retries <count> tries per failed frame, retried after the rest of the card (default "+str(MAX_ATTEMPTS)+")")
+	print("--pipeline <depth> keeps up to <depth> frame reads queued on the serial link (default 1, max "+str(MAX_DEPTH)+")")
+	print("--daemon keeps the given ports open and runs jobs sent to [--socket <path>] (default "+DAEMON_SOCKET+") until interrupted")
+	print("--socket <path> sends the operation to a running daemon instead of opening the port, -p picks the board if it has several")
+	print("--profile prints where the time of every frame went (transmit, wait on the board, receive, host) at the end, firmware 0.C adds the board's ack wait and delay counters")
+	print("--profile-out <file> saves the per frame timings, as csv for a .csv file and json otherwise")
+	print("format command formats memorycard with all \\x00")
+	print("--quick-format only writes the header and directory frames, [--clear-allocated] also wipes blocks that held saves\n")
 
-		if(b == b'\x47'):
-			f.write(temp)
-			print("OK at frame "+frame+"/128 TimeTaken:"+str(tPrint))
-			passed += 1
+	print("pocketstation commands:")
+	print("--psinfo (print info from pocketstation)")
+	print("--psbios <output file> (dump bios from pocketstation), [--cache <directory>] keeps known bios images to check the dump against, [--trust-cache] stops once sampled chunks match a single cached image and takes the rest from it")
+	print("--pstime (appy pc time to pocketstation)\n\n\n")
 
-	checksum &= 0xFFFFFFFF
-	print("checksum: %08x" % (checksum))
+def no_pocketstation():
+	print("pocketstation not found")
 
-	#check if this is a known or maybe a bad dump
-	if(checksum == 0x27E94C07):
-		print("1st release")
-	elif(checksum == 0xB16CE96C):
-		print("2nd release")
-	elif(checksum == 0x1BABAF29):
-		print("dtl-h4000")
+def print_listing(listing):
+	print("\n")
+	if listing["formatted"] is None:
+		print("warning: header frame could not be read")
+	elif not listing["formatted"]:
+		print("warning: card is not formatted")
+	for entry in listing["slots"]:
+		line = "slot "+str(entry["slot"]).rjust(2)+"  "+entry["state"].ljust(14)
+		if entry["state"] == "first":
+			line += "  "+entry["region"]+" "+entry["product"].ljust(10)+" "+entry["identifier"].ljust(8)+"  "+str(entry["blocks"])+" blocks  chain:"+",".join(str(block) for block in entry["chain"])
+		if entry["checksum_ok"] is False:
+			line += "  (bad checksum)"
+		print(line.rstrip())
+
+def print_info(info):
+	if info is None:
+		no_pocketstation()
 	else:
-		print("unknown or bad dump, redump to verify")
+		print("serial: "+info["serial"])
+		print("date: "+info["date"])
+		print("time: "+info["time"])
+		print("day: "+info["day"])
 
-def get_bcd(value):
-	tens = value // 10
-	single = value - (tens * 10)
+def timed(operation, *args):
+	tOpStart = datetime.now()
+	operation(*args)
+	tOpEnd = datetime.now()
+	tOpDelta=tOpEnd-tOpStart
+	print("Total Time:"+str(tOpDelta))
 
-	return ((tens << 4) | single)
+def expand_ports(patterns):
+	#each -p is a port, a comma separated list of ports or a glob like /dev/ttyACM* (also termios:/dev/ttyACM*)
+	#urls are taken as they are, a ? in them starts their options
+	ports = []
+	for pattern in patterns:
+		for name in pattern.split(","):
+			prefix = "termios:" if name.startswith("termios:") else ""
+			if "://" not in name and any(c in name for c in "*?["):
+				ports.extend(prefix + path for path in sorted(glob.glob(name[len(prefix):])))
+			elif name:
+				ports.append(name)
+	return list(dict.fromkeys(ports))
 
-def ps_time():
-	print("set pocketstation time:")
+def device_file(file, port):
+	#{device} in the file name is replaced by the port name, otherwise it goes in front of the extension
+	device = os.path.basename(port)
+	if "{device}" in file:
+		return file.replace("{device}", device)
+	root, ext = os.path.splitext(file)
+	return root+"-"+device+ext
 
-	ser.write(PSTIME)
+def job_summary(port, mode):
+	return {"port": port, "mode": mode, "file": "", "ok": False, "frames": 0, "failed": 0, "link_errors": 0, "card_errors": 0, "seconds": 0.0, "error": ""}
 
-	#parameter check
-	b = ser.read(1)
-	if(b[0] != 0x0):
-		no_pocketstation()
+def run_job(client, mode, file, per_device=False, resume=False, diff=False, cache="", sparse=False, clear=False, slot=0, trust_cache=False):
+	#one operation on an open client, returns what print_summary reports for it
+	#with per_device the files are named after the board, see device_file
+	port = client.port
+	summary = job_summary(port, mode)
+	client.last_result = None
+	tStart = datetime.now()
+	try:
+		if client.auto_capacity and not client.detected and mode not in POCKETSTATION_MODES:
+			client.detect_capacity()
+		if mode == "READ":
+			summary["file"] = device_file(file, port) if per_device else file
+			with open(summary["file"], 'r+b' if resume and os.path.isfile(summary["file"]) else 'w+b') as f:
+				if sparse:
+					client.read_sparse(f)
+				else:
+					client.read(f, summary["file"] + ".ckpt", resume)
+		elif mode == "WRITE":
+			#the same image goes to every card unless the file name asks for one per board
+			summary["file"] = device_file(file, port) if per_device and "{device}" in file else file
+			with open(summary["file"], 'rb') as f:
+				if diff:
+					client.write_diff(f, device_file(cache, port) if per_device and cache else cache)
+				else:
+					client.write(f, (device_file(file, port) if per_device else file) + ".ckpt", resume)
+		elif mode == "FORMAT":
+			client.format()
+		elif mode == "QUICKFORMAT":
+			client.quick_format(clear)
+		elif mode == "LIST":
+			summary["listing"] = client.list_directory()
+			summary["ok"] = True
+		elif mode == "EXPORT":
+			summary["file"] = file
+			with open(file, 'wb') as f:
+				client.export_save(f, slot)
+		elif mode == "IMPORT":
+			summary["file"] = file
+			with open(file, 'rb') as f:
+				client.import_save(f)
+		elif mode == "PSINFO":
+			summary["info"] = client.ps_info()
+			summary["ok"] = summary["info"] is not None
+		elif mode == "PSBIOS":
+			summary["file"] = file
+			with open(file, 'wb') as f:
+				summary["checksum"] = format(client.ps_bios(f, cache, trust_cache), '08x')
+			summary["ok"] = True
+		elif mode == "PSTIME":
+			summary["ok"] = client.ps_time()
+	except (MemCARDuinoError, serial.SerialException, OSError) as e:
+		summary["error"] = str(e)
+	summary["seconds"] = (datetime.now() - tStart).total_seconds()
+	if client.last_result is not None:
+		summary.update(client.last_result)
+		summary["ok"] = summary["failed"] == 0 and not summary["error"]
+	return summary
+
+def run_device(port, mode, file, rate=115200, capacity=1024, depth=1, max_attempts=MAX_ATTEMPTS, profile=False, profile_out="", **options):
+	#one board of a multi device run
+	#with profile the summary gets the Profile report, profile_out saves the frames like device_file names them
+	client = MemCardClient(port, rate=rate, capacity=capacity, depth=depth, max_attempts=max_attempts, name=os.path.basename(port))
+	if profile or profile_out:
+		client.profile = Profile()
+	try:
+		client.open()
+	except (MemCARDuinoError, serial.SerialException, OSError) as e:
+		summary = job_summary(port, mode)
+		summary["error"] = str(e)
+		return summary
+	with client:
+		summary = run_job(client, mode, file, per_device=True, **options)
+		if client.profile is not None:
+			try:
+				client.profile.board = client.board_stats()
+			except (MemCARDuinoError, serial.SerialException, OSError):
+				pass
+	if profile:
+		summary["profile"] = client.profile.summary()
+	if profile_out:
+		client.profile.save(device_file(profile_out, port))
+	return summary
+
+def run_devices(ports, mode, file, **options):
+	#every board gets its own thread and connection, pyserial releases the GIL while it waits on the link
+	print("running "+mode.lower()+" on "+str(len(ports))+" devices: "+", ".join(ports)+"\n")
+	tStart = datetime.now()
+	with ThreadPoolExecutor(max_workers=len(ports)) as pool:
+		summaries = list(pool.map(lambda port: run_device(port, mode, file, **options), ports))
+	return summaries, datetime.now() - tStart
+
+def print_results(summaries, mode, as_json, output, tTotal):
+	#what jobs run by run_devices or the daemon found, one summary per board
+	if mode == "LIST":
+		listings = {summary["port"]: summary.get("listing") for summary in summaries}
+		if as_json:
+			output.write(json.dumps(listings if len(summaries) > 1 else summaries[0].get("listing"), indent=2) + "\n")
+		else:
+			for summary in summaries:
+				if summary.get("listing") is not None:
+					if len(summaries) > 1:
+						print("\n"+summary["port"]+":", end="")
+					print_listing(summary["listing"])
+	elif mode == "PSINFO":
+		for summary in summaries:
+			if not summary["error"]:
+				print_info(summary.get("info"))
+	elif mode == "PSTIME":
+		for summary in summaries:
+			if summary["ok"]:
+				print(datetime.now())
+			elif not summary["error"]:
+				no_pocketstation()
+	for summary in summaries:
+		if "profile" in summary:
+			print_profile(summary["profile"], summary["port"] if len(summaries) > 1 else None)
+	if len(summaries) > 1:
+		print_summary(summaries, tTotal)
 		return
+	for summary in summaries:
+		if summary["error"]:
+			print("error: "+summary["error"])
+	print("Total Time:"+str(tTotal))
 
-	#datasize check
-	b = ser.read(1)
-	if(b[0] != 0x8):
-		no_pocketstation()
+def print_profile(report, name=None):
+	#where the time of the frames went, the phase with the biggest share is what holds the rig back
+	line = "\nprofile"+(" "+name if name else "")+": "+str(report["frames"])+" frames in "+format(report["seconds"], '.2f')+"s, "+format(report["frames_per_second"], '.1f')+" frames/s"
+	if report["failed"]:
+		line += ", "+str(report["failed"])+" failed"
+	print(line)
+	if not report["frames"]:
 		return
+	print("  phase      share      mean      p50      p90      p99      max  [us]")
+	for phase in ("total",) + PROFILE_PHASES:
+		stats = report["phases"][phase]
+		print("  "+phase.ljust(9)+format(stats["share"] * 100, '6.1f')+"%"+"".join(format(stats[key], '9.0f') for key in ("mean_us", "p50_us", "p90_us", "p99_us", "max_us")))
+	print("  frame time histogram:")
+	histogram = report["phases"]["total"]["histogram"]
+	most = max(histogram.values())
+	for bound in sorted(histogram):
+		print("  "+("< "+str(bound)+"us").rjust(11)+" "+("#" * max(1, histogram[bound] * 40 // most)).ljust(40)+" "+str(histogram[bound]))
+	slowest = max(PROFILE_PHASES, key=lambda phase: report["phases"][phase]["share"])
+	print("  most time in "+slowest+": "+PROFILE_HINTS[slowest])
+	board = report.get("board")
+	if board:
+		print_board(board)
 
-	time_data = [get_bcd(datetime.now().day),
-		get_bcd(datetime.now().month),
-		get_bcd(datetime.now().year % 100),
-		get_bcd(datetime.now().year // 100),
-		get_bcd(datetime.now().second),
-		get_bcd(datetime.now().minute),
-		get_bcd(datetime.now().hour),
-		get_bcd((datetime.now().weekday() + 2) % 7)]
+def print_board(board):
+	#what the firmware counted on the card side, ack wait against the fixed delays tells if the delays can be tuned
+	print("  board: "+str(board["frames_read"])+" frames read, "+str(board["frames_written"])+" written, "+str(board["bad_status"])+" bad status, "+str(board["ack_timeouts"])+" ack timeouts")
+	if not board["card_bytes"]:
+		return
+	print("  card bytes: "+str(board["card_bytes"])+", ack wait "+format(board["ack_wait_us"] / board["card_bytes"], '.1f')+"us/byte, fixed delays "+format(board["padding_us"] / board["card_bytes"], '.1f')+"us/byte")
+	frames = board["frames_read"] + board["frames_written"]
+	if frames:
+		print("  per frame: ack wait "+format(board["ack_wait_us"] / frames / 1000, '.2f')+"ms, fixed delays "+format(board["padding_us"] / frames / 1000, '.2f')+"ms")
+	if board["ack_timeouts"]:
+		print("  card misses acks: every byte after a timeout waits out the compatible mode timeout, check the ack wire")
+	elif board["padding_us"] > board["ack_wait_us"]:
+		print("  fixed delays take longer than the card, this card could take shorter ones")
+	else:
+		print("  the card is slower than the fixed delays, shorter delays won't help")
 
-	#push data to pocketstation
-	ser.write(bytearray(time_data))
+def print_summary(summaries, tTotal):
+	print("\n\n\ndevice summary:")
+	frames = 0
+	failed = 0
+	for summary in summaries:
+		line = "  "+summary["port"].ljust(16)+" "
+		if summary["error"]:
+			line += "ERROR: "+summary["error"]
+		else:
+			line += ("OK" if summary["ok"] else "FAILED").ljust(7)+str(summary["frames"]).rjust(5)+" frames  "+format(summary["seconds"], '.1f')+"s"
+			if summary["frames"] and summary["seconds"]:
+				line += "  "+format(summary["frames"] / summary["seconds"], '.1f')+" frames/s"
+			if summary["link_errors"] or summary["card_errors"]:
+				line += "  link errors: "+str(summary["link_errors"])+"  card errors: "+str(summary["card_errors"])
+			if summary["file"]:
+				line += "  "+summary["file"]
+		print(line)
+		frames += summary["frames"]
+		if not summary["ok"]:
+			failed += 1
+	seconds = tTotal.total_seconds()
+	print("total: "+str(frames)+" frames from "+str(len(summaries))+" devices in "+str(tTotal)+(", "+format(frames / seconds, '.1f')+" frames/s" if frames and seconds else ""))
+	if failed:
+		print(str(failed)+" of "+str(len(summaries))+" devices failed\n")
+	else:
+		print("SUCCESS")
 
-	print(datetime.now())
+# Daemon Functions
+class DeviceWorker(threading.Thread):
+	"""Keeps one board open for the daemon and runs the jobs queued for it one after another.
 
-def result(passed):
-	print("\n\n\n")
-	if(passed == end):
-		print("SUCCESS")
-	else:
-		print(mode + " ERROR: "+str(end-passed)+" failed\n")
+	An idle board is probed with GETID every DAEMON_PROBE_INTERVAL seconds and reopened when it
+	stops answering, so jobs don't pay for opening the port and the handshake.
+	"""
+
+	def __init__(self, port, rate=115200, capacity=1024, depth=1, max_attempts=MAX_ATTEMPTS):
+		threading.Thread.__init__(self, daemon=True)
+		self.port = port
+		self.client = MemCardClient(port, rate=rate, capacity=capacity, depth=depth, max_attempts=max_attempts, name=os.path.basename(port))
+		self.jobs = queue.Queue()
+		self.busy = False
+
+	def connect(self):
+		self.client.close()
+		try:
+			#a pocketstation or an empty slot is fine, the card is checked before every job that needs one
+			self.client.open(check_card=False)
+			return True
+		except (MemCARDuinoError, serial.SerialException, OSError) as e:
+			print(self.port+": "+str(e))
+			self.client.close()
+			return False
+
+	def submit(self, request, send, per_device, finished):
+		#send(message) streams to the client, finished(summary) is called once the job is done
+		waiting = self.jobs.qsize() + (1 if self.busy else 0)
+		if waiting:
+			send({"log": self.port+": queued behind "+str(waiting)+" jobs"})
+		self.jobs.put((request, send, per_device, finished))
+
+	def stop(self):
+		self.jobs.put(None)
+
+	def run(self):
+		self.connect()
+		while True:
+			try:
+				job = self.jobs.get(timeout=DAEMON_PROBE_INTERVAL)
+			except queue.Empty:
+				if self.client.ser is None or not self.client.wait_ready(PROBE_TIMEOUT):
+					self.connect()
+				continue
+			if job is None:
+				break
+			request, send, per_device, finished = job
+			self.busy = True
+			try:
+				if self.client.ser is None and not self.connect():
+					summary = job_summary(self.port, request["mode"])
+					summary["error"] = "mcduino communication error, "+self.port+" can't be opened"
+				else:
+					self.client.detected = False	# the card may have been swapped since the last job
+					self.client.output = lambda line: send({"log": line})
+					try:
+						if request["mode"] not in POCKETSTATION_MODES:
+							self.client.check_connection(True)
+						summary = run_job(self.client, request["mode"], request["file"], per_device, **request["options"])
+					except MemCARDuinoError as e:
+						#no card or it doesn't answer, don't run every frame of the job into an empty slot
+						summary = job_summary(self.port, request["mode"])
+						summary["error"] = str(e)
+					self.client.output = None
+					if summary["error"] and not self.client.wait_ready(PROBE_TIMEOUT):
+						self.connect()
+			except Exception as e:
+				#whatever went wrong, the worker stays up and the client gets its answer
+				#the board may be anywhere in a response, start over with a fresh connection
+				self.client.output = None
+				summary = job_summary(self.port, request["mode"])
+				summary["error"] = "job failed, "+type(e).__name__+": "+str(e)
+				print(self.port+": "+summary["error"])
+				self.connect()
+			self.busy = False
+			finished(summary)
+		self.client.close()
+
+class JobHandler(socketserver.StreamRequestHandler):
+	"""One connection to the daemon: a json request line in, json lines of progress and results out.
+
+	The request is {"mode": ..., "ports": [...], "file": ..., "options": {...}} with the options of run_job,
+	every message back has a "log", "result" or "error" key.
+	"""
+
+	def handle(self):
+		lock = threading.Lock()
+		def send(message):
+			with lock:
+				try:
+					self.wfile.write((json.dumps(message)+"\n").encode())
+					self.wfile.flush()
+				except OSError:
+					pass	# client went away, the job still runs to the end
+		try:
+			request = json.loads(self.rfile.readline())
+		except ValueError:
+			send({"error": "bad request"})
+			return
+		workers = self.server.workers
+		ports = request.get("ports") or []
+		if not ports and len(workers) == 1:
+			ports = list(workers)
+		if not ports:
+			send({"error": "daemon serves "+", ".join(workers)+", pick one with -p"})
+			return
+		unknown = [port for port in ports if port not in workers]
+		if unknown:
+			send({"error": ", ".join(unknown)+" not served by this daemon"})
+			return
+		if request.get("mode") not in DAEMON_MODES:
+			send({"error": "unknown operation "+repr(request.get("mode"))})
+			return
+		request.setdefault("file", "")
+		request.setdefault("options", {})
+		if not isinstance(request["file"], str) or not isinstance(request["options"], dict):
+			send({"error": "bad request"})
+			return
+		unknown = [option for option in request["options"] if option not in JOB_OPTIONS]
+		if unknown:
+			send({"error": "unknown options "+", ".join(repr(option) for option in unknown)})
+			return
+		done = threading.Semaphore(0)
+		def finished(summary):
+			send({"result": summary})
+			done.release()
+		for port in ports:
+			workers[port].submit(request, send, len(ports) > 1, finished)
+		for port in ports:
+			done.acquire()
+
+# options a daemon request can pass on to run_job
+JOB_OPTIONS = tuple(inspect.signature(run_job).parameters)[4:]
 
-#MAIN VARIABLES
-start = 0
-end = 1024
-frame_size = 128
-inputport = ""
-rate = 115200
-file = ""
-mode = ""
+def serve_daemon(path, ports, **options):
+	#own the ports until interrupted and run the jobs sent to the unix socket at path
+	if not hasattr(socket, "AF_UNIX"):
+		print("error: daemon mode needs unix domain sockets")
+		return
+	if os.path.exists(path):
+		try:
+			with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+				probe.connect(path)
+			print("error: a daemon is already listening on "+path)
+			return
+		except OSError:
+			os.remove(path)		# left behind by a daemon that didn't shut down
+	workers = {port: DeviceWorker(port, **options) for port in ports}
+	for worker in workers.values():
+		worker.start()
+	server = socketserver.ThreadingUnixStreamServer(path, JobHandler)
+	server.daemon_threads = True
+	server.workers = workers
+	print("memcarduino daemon listening on "+path+" for "+", ".join(ports))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		os.remove(path)
+		for worker in workers.values():
+			worker.stop()
+		for worker in workers.values():
+			worker.join()
+
+def submit_job(path, request):
+	#hand a job to the daemon at path, prints its progress and returns the summary of every board
+	summaries = []
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+		try:
+			sock.connect(path)
+		except OSError as e:
+			raise MemCARDuinoError("no daemon listening on "+path+" ("+str(e)+")")
+		sock.sendall((json.dumps(request)+"\n").encode())
+		with sock.makefile('r') as f:
+			for line in f:
+				message = json.loads(line)
+				if "log" in message:
+					print(message["log"])
+				elif "result" in message:
+					summaries.append(message["result"])
+				elif "error" in message:
+					raise MemCARDuinoError(message["error"])
+	return summaries
+
+def main(argv=None):
+	if argv is None:
+		argv = sys.argv[1:]
+
+	#MAIN VARIABLES
+	end = 1024
+	inputport = ""
+	patterns = []
+	rate = 115200
+	file = ""
+	mode = ""
+	depth = 1
+	diff = False
+	cache = ""
+	trust_cache = False
+	clear = False
+	sparse = False
+	slot = 0
+	as_json = False
+	max_attempts = MAX_ATTEMPTS
+	resume = False
+	daemon = False
+	socket_path = ""
+	profile = False
+	profile_out = ""
+
+	opts, args = getopt.getopt(argv , "hfp:r:w:c:b" , [ "help" , "format" , "port=" , "read=" , "write=" , "capacity=" , "bitrate=", "psinfo", "psbios=", "pstime", "pipeline=", "diff", "cache=", "trust-cache", "quick-format", "clear-allocated", "sparse", "export=", "import=", "slot=", "list", "json", "retries=", "resume", "daemon", "socket=", "profile", "profile-out="])
 
-opts, args = getopt.getopt(sys.argv[1:] , "hfp:r:w:c:b" , [ "help" , "format" , "port=" , "read=" , "write=" , "capacity=" , "bitrate=", "psinfo", "psbios=", "pstime"])
 
+	#OPTIONS CHECK
 
-#OPTIONS CHECK
+	print("\n\n")
 
-print("\n\n")
+	for opt, arg in opts:
+		#print opt
+		#print arg
+		if opt in ("-h" , "--help"):
+			help()
+			sys.exit()
+		elif opt in ("-f" , "--format"):
+			mode = "FORMAT"
+		elif opt in ("-p" , "--port"):
+			patterns.append(arg)
+		elif opt in("-r", "--read"):
+			file = arg
+			mode = "READ"
+		elif opt in("-w", "--write"):
+			file = arg
+			mode = "WRITE"
+		elif opt in ("-c" , "--capacity"):
+			end = None if arg == "auto" else int(arg)
+		elif opt in("-b", "--bitrate"):
+			print("warning: bitrate should not be changed unless necessary")
+			rate = int(arg)
+		elif opt in("--psinfo"):
+			mode = "PSINFO"
+		elif opt in("--psbios"):
+			file = arg
+			mode = "PSBIOS"
+		elif opt in("--pstime"):
+			mode = "PSTIME"
+		elif opt in("--pipeline"):
+			depth = int(arg)
+		elif opt in("--quick-format"):
+			mode = "QUICKFORMAT"
+		elif opt in("--clear-allocated"):
+			clear = True
+		elif opt in("--sparse"):
+			sparse = True
+		elif opt in("--export"):
+			file = arg
+			mode = "EXPORT"
+		elif opt in("--import"):
+			file = arg
+			mode = "IMPORT"
+		elif opt in("--slot"):
+			slot = int(arg)
+		elif opt in("--list"):
+			mode = "LIST"
+		elif opt in("--json"):
+			as_json = True
+		elif opt in("--resume"):
+			resume = True
+		elif opt in("--retries"):
+			max_attempts = int(arg)
+		elif opt in("--diff"):
+			diff = True
+		elif opt in("--cache"):
+			cache = arg
+		elif opt in("--trust-cache"):
+			trust_cache = True
+		elif opt in("--daemon"):
+			daemon = True
+		elif opt in("--socket"):
+			socket_path = arg
+		elif opt in("--profile"):
+			profile = True
+		elif opt in("--profile-out"):
+			profile_out = arg
+		else:
+			help()
+			sys.exit()
 
-for opt, arg in opts:
-	#print opt
-	#print arg
-	if opt in ("-h" , "--help"):
+	ports = expand_ports(patterns)
+	#a running daemon picks the board itself if it only has one
+	if not ports and (daemon or socket_path == ""):
+		print("warning: no serial port specified")
 		help()
 		sys.exit()
-	elif opt in ("-f" , "--format"):
-		mode = "FORMAT"
-	elif opt in ("-p" , "--port"):
-		inputport = arg
-	elif opt in("-r", "--read"):
-		file = arg
-		mode = "READ"
-	elif opt in("-w", "--write"):
-		file = arg
-		mode = "WRITE"
-	elif opt in ("-c" , "--capacity"):
-		end = int(arg)
-	elif opt in("-b", "--bitrate"):
-		print("warning: bitrate should not be changed unless necessary")
-		rate = int(arg)
-	elif opt in("--psinfo"):
-		mode = "PSINFO"
-	elif opt in("--psbios"):
-		file = arg
-		mode = "PSBIOS"
-	elif opt in("--pstime"):
-		mode = "PSTIME"
-	else:
+	if file == "" and (mode == "WRITE" or mode == "READ" or mode == "PSBIOS" or mode == "EXPORT" or mode == "IMPORT"):
+		print('warning: input/output file missing')
 		help()
 		sys.exit()
 
-if inputport == "":
-	print("warning: no serial port specified")
-	help()
-	sys.exit()
-if file == "" and (mode == "WRITE" or mode == "READ" or mode == "PSBIOS"):
-	print('warning: input/output file missing')
-	help()
-	sys.exit()
+	#keep stdout clean for the json listing, progress goes to stderr
+	output = sys.stdout
+	if as_json:
+		sys.stdout = sys.stderr
 
+	#BEGIN
 
-#BEGIN
+	if daemon:
+		serve_daemon(socket_path or DAEMON_SOCKET, ports, rate=rate, capacity=end, depth=depth, max_attempts=max_attempts)
+		return
 
-ser = serial.Serial(port=inputport, baudrate=rate,timeout=2)
+	if socket_path:
+		if mode not in DAEMON_MODES:
+			print("warning: no operation selected")
+			sys.exit()
+		#the daemon opens the files itself, paths are sent absolute
+		request = {"mode": mode, "ports": ports, "file": os.path.abspath(file) if file else "",
+			"options": {"resume": resume, "diff": diff, "cache": os.path.abspath(cache) if cache else "", "sparse": sparse, "clear": clear, "slot": slot, "trust_cache": trust_cache}}
+		tStart = datetime.now()
+		try:
+			summaries = submit_job(socket_path, request)
+		except MemCARDuinoError as e:
+			print("error: "+str(e)+"\n\n")
+			sys.exit()
+		print_results(summaries, mode, as_json, output, datetime.now() - tStart)
+		return
 
-test()
+	if len(ports) > 1:
+		if mode not in DEVICE_MODES:
+			print("warning: only read, write, format, quick format and list run on several ports at once")
+			sys.exit()
+		summaries, tTotal = run_devices(ports, mode, file, rate=rate, capacity=end, depth=depth, max_attempts=max_attempts, resume=resume, diff=diff, cache=cache, sparse=sparse, clear=clear, profile=profile, profile_out=profile_out)
+		print_results(summaries, mode, as_json, output, tTotal)
+		return
+	inputport = ports[0]
 
-if mode == "WRITE":
-	f = open(file, 'rb')
-	tOpStart = datetime.now()
-	memcard_write(f)
-	tOpEnd = datetime.now()
-	f.close()
-	tOpDelta=tOpEnd-tOpStart
-	print("Total Time:"+str(tOpDelta))
-elif mode == "READ":
-	f = open(file, 'wb')
-	tOpStart = datetime.now()
-	memcard_read(f)
-	tOpEnd = datetime.now()
-	f.close()
-	tOpDelta=tOpEnd-tOpStart
-	print("Total Time:"+str(tOpDelta))
-elif mode == "FORMAT":
-	tOpStart = datetime.now()
-	memcard_format()
-	tOpEnd = datetime.now()
-	tOpDelta=tOpEnd-tOpStart
-	print("Total Time:"+str(tOpDelta))
-elif mode == "PSINFO":
-	ps_info()
-elif mode == "PSBIOS":
-	f = open(file, 'wb')
-	tOpStart = datetime.now()
-	ps_bios(f)
-	tOpEnd = datetime.now()
-	f.close()
-	tOpDelta=tOpEnd-tOpStart
-	print("Total Time:"+str(tOpDelta))
-elif mode == "PSTIME":
-	ps_time()
-else:
-	print("warning: no operation selected")
+	client = MemCardClient(inputport, rate=rate, capacity=end, depth=depth, max_attempts=max_attempts)
+	if profile or profile_out:
+		client.profile = Profile()
+	try:
+		#do not check frame reading for pocketstation commands
+		client.open(check_card=mode not in POCKETSTATION_MODES)
+	except MemCARDuinoError as e:
+		print("error: "+str(e)+"\n\n")
+		sys.exit()
+
+	with client:
+		if mode == "WRITE":
+			with open(file, 'rb') as f:
+				if diff:
+					timed(client.write_diff, f, cache)
+				else:
+					timed(client.write, f, file + ".ckpt", resume)
+		elif mode == "READ":
+			with open(file, 'r+b' if resume and os.path.isfile(file) else 'w+b') as f:
+				if sparse:
+					timed(client.read_sparse, f)
+				else:
+					timed(client.read, f, file + ".ckpt", resume)
+		elif mode == "FORMAT":
+			timed(client.format)
+		elif mode == "QUICKFORMAT":
+			try:
+				timed(client.quick_format, clear)
+			except MemCARDuinoError as e:
+				print(str(e))
+				sys.exit()
+		elif mode == "LIST":
+			listing = client.list_directory()
+			if as_json:
+				output.write(json.dumps(listing, indent=2) + "\n")
+			else:
+				print_listing(listing)
+		elif mode == "EXPORT":
+			try:
+				with open(file, 'wb') as f:
+					timed(client.export_save, f, slot)
+			except MemCARDuinoError as e:
+				print(str(e))
+				sys.exit()
+		elif mode == "IMPORT":
+			with open(file, 'rb') as f:
+				timed(client.import_save, f)
+		elif mode == "PSINFO":
+			print("pocketstation info:")
+			print_info(client.ps_info())
+		elif mode == "PSBIOS":
+			print("dump pocketstation bios:")
+			try:
+				with open(file, 'wb') as f:
+					timed(client.ps_bios, f, cache, trust_cache)
+			except MemCARDuinoError as e:
+				print(str(e))
+				sys.exit()
+		elif mode == "PSTIME":
+			print("set pocketstation time:")
+			if client.ps_time():
+				print(datetime.now())
+			else:
+				no_pocketstation()
+		else:
+			print("warning: no operation selected")
+		if client.profile is not None:
+			client.profile.board = client.board_stats()
+
+	if profile:
+		print_profile(client.profile.summary())
+	if profile_out:
+		client.profile.save(profile_out)
 
-ser.close()
\ No newline at end of file
+if __name__ == "__main__":
+	main()
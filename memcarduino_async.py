@@ -0,0 +1,393 @@
+#!python3
+
+#MemCARDuino asyncio interface
+#speaks the same serial protocol as memcarduino.py from an asyncio event loop, so one loop can drive
+#any number of boards next to whatever else the application serves, without a thread per port.
+#the port is used as a non-blocking file descriptor, this needs a posix system (linux, macos).
+#	async with AsyncMemCardClient("/dev/ttyACM0") as client:
+#		data = await client.read_frame(0)
+#		async for address, data in client.frames():
+#			...
+#use and modification of this script is allowed, if improved do send a copy back.
+import os
+import sys
+import getopt
+import asyncio
+import serial
+from datetime import datetime
+
+from memcarduino import (GID, GFV, MCR, PSINFO, PSBIOS, PSTIME, MAX_DEPTH, PROBE_TIMEOUT, READY_TIMEOUT,
+	MAX_ATTEMPTS, RETRY_DELAY, RETRY_MAX_DELAY, CARD_ERRORS, MemCARDuinoError, FrameCodec, XorElementByteArray,
+	status_name, ps_info_fields, ps_time_data, bios_checksum, expand_ports, device_file, BIOS_CHUNK, BIOS_CHUNKS, BIOS_SIZE)
+
+QUIET_TIME = 0.02	# seconds without input after which what is left of a broken response has arrived
+
+class AsyncMemCardClient:
+	"""asyncio counterpart of MemCardClient.
+
+	Requests on one client are serialized by a lock, so any number of tasks can share it.
+	Every request takes a timeout in seconds for the whole request (none by default) and raises
+	asyncio.TimeoutError when it runs out, single reads from the board give up after the client's timeout.
+	A request that times out or is cancelled halfway leaves its response on the link, the board is
+	probed back into sync before the next request goes out. Frames that fail are retried up to
+	max_attempts times before MemCARDuinoError is raised.
+	"""
+
+	def __init__(self, port, rate=115200, capacity=1024, timeout=2, max_attempts=MAX_ATTEMPTS):
+		self.port = port
+		self.rate = rate
+		self.timeout = timeout
+		self.end = capacity			#number of frames on the card (default 1024)
+		self.frame_size = 128
+		self.max_attempts = max(1, max_attempts)
+		self.ser = None
+		self.fd = None
+		self.loop = None
+		self.lock = None
+		self.codec = FrameCodec(self.frame_size)
+		self.version = None			#firmware version byte, read when connecting
+		self.buffer = bytearray()	#received bytes nobody asked for yet
+		self.wanted = 0
+		self.waiter = None			#future of the recv waiting for self.wanted bytes
+		self.lost = None			#error the port failed with
+		self.stale = False			#a request was abandoned with its response still coming
+
+	async def __aenter__(self):
+		if self.ser is None:
+			await self.open()
+		return self
+
+	async def __aexit__(self, *exc):
+		self.close()
+
+	async def open(self, check_card=True):
+		self.loop = asyncio.get_running_loop()
+		self.lock = asyncio.Lock()
+		self.ser = serial.Serial(port=self.port, baudrate=self.rate, timeout=0)
+		self.attach()
+		if not await self.wait_ready(PROBE_TIMEOUT):
+			# the arduino may reset when the port is opened, reopen and poll until it is back up
+			self.detach()
+			self.ser.close()
+			self.ser.open()
+			self.attach()
+			if not await self.wait_ready(READY_TIMEOUT):
+				self.close()
+				raise MemCARDuinoError("mcduino communication error, no answer to GETID on "+self.port)
+		self.version = await self.get_version()
+		if check_card:
+			#test first frame
+			await self.send(MCR + b"\x00\x01")
+			b = await self.recv(self.frame_size + 2)
+			if len(b) != self.frame_size + 2 or b[-1] != 0x47:
+				self.close()
+				raise MemCARDuinoError("mc read failure, check connections (response byte is "+repr(b[-1:])+")")
+
+	def close(self):
+		if self.ser is not None:
+			self.detach()
+			self.ser.close()
+			self.ser = None
+
+	def attach(self):
+		self.fd = self.ser.fileno()
+		os.set_blocking(self.fd, False)
+		self.buffer.clear()
+		self.lost = None
+		self.loop.add_reader(self.fd, self.readable)
+
+	def detach(self):
+		if self.fd is not None:
+			self.loop.remove_reader(self.fd)
+			self.fd = None
+
+	def readable(self):
+		#called by the event loop whenever the port has input
+		try:
+			data = os.read(self.fd, 4096)
+		except BlockingIOError:
+			return
+		except OSError as e:
+			data = None
+			self.lost = MemCARDuinoError("lost connection to "+self.port+": "+str(e))
+		if not data:
+			#unplugged, stop listening or the loop spins on a hung up port
+			self.lost = self.lost or MemCARDuinoError("lost connection to "+self.port)
+			self.detach()
+		else:
+			self.buffer += data
+		if self.waiter is not None and not self.waiter.done() and (self.lost or len(self.buffer) >= self.wanted):
+			self.waiter.set_result(None)
+
+	async def send(self, data):
+		if self.lost:
+			raise self.lost
+		view = memoryview(data)
+		while view:
+			try:
+				written = os.write(self.fd, view)
+			except BlockingIOError:
+				written = 0
+			view = view[written:]
+			if view:
+				#output buffer is full, wait until the port takes more
+				ready = self.loop.create_future()
+				self.loop.add_writer(self.fd, ready.set_result, None)
+				try:
+					await ready
+				finally:
+					self.loop.remove_writer(self.fd)
+
+	async def recv(self, count, timeout=None):
+		#count bytes from the board, fewer if they don't all arrive within timeout (the client's timeout by default)
+		if len(self.buffer) < count and not self.lost:
+			self.wanted = count
+			self.waiter = self.loop.create_future()
+			try:
+				await asyncio.wait_for(self.waiter, self.timeout if timeout is None else timeout)
+			except asyncio.TimeoutError:
+				pass
+			finally:
+				self.waiter = None
+		if self.lost and len(self.buffer) < count:
+			raise self.lost
+		data = bytes(self.buffer[:count])
+		del self.buffer[:count]
+		return data
+
+	async def flush(self):
+		#drop what is left of a response that lost sync, the board is done once the link goes quiet
+		while True:
+			self.buffer.clear()
+			await asyncio.sleep(QUIET_TIME)
+			if not self.buffer:
+				return
+
+	async def wait_ready(self, timeout):
+		#poll GETID until the board identifies itself or timeout runs out
+		deadline = self.loop.time() + timeout
+		while True:
+			self.buffer.clear()
+			await self.send(GID)
+			if await self.recv(6, PROBE_TIMEOUT) == b'MCDINO':
+				return True
+			if self.loop.time() >= deadline:
+				return False
+
+	async def get_version(self):
+		await self.send(GFV)
+		b = await self.recv(1)
+		if len(b) != 1:
+			raise MemCARDuinoError("mcduino communication error, no firmware version")
+		return b[0]
+
+	async def request(self, operation, timeout=None):
+		#one request at a time on the link, one cut short by a timeout or cancellation leaves the link stale
+		if self.ser is None:
+			raise MemCARDuinoError("port "+self.port+" is not open")
+		async with self.lock:
+			if self.stale:
+				await self.flush()
+				if not await self.wait_ready(READY_TIMEOUT):
+					raise MemCARDuinoError("mcduino communication error, no answer to GETID on "+self.port)
+			self.stale = True
+			result = await asyncio.wait_for(operation(), timeout)
+			self.stale = False
+			return result
+
+	async def backoff(self, attempt):
+		await asyncio.sleep(min(RETRY_MAX_DELAY, RETRY_DELAY * (2 ** attempt)))
+
+	# Memory Card Functions
+	async def receive_frame(self, address):
+		#response to a MCR already sent, returns (data, None) or (None, error)
+		b = await self.recv(self.frame_size + 2)
+		status = b[-1] if len(b) == self.frame_size + 2 else -1
+		if(status == 0x47 and b[-2] != (address >> 8) ^ (address & 0xFF) ^ XorElementByteArray(b[0:self.frame_size])):
+			return None, "LINK CHECKSUM"
+		elif(status == 0x47):
+			return b[0:self.frame_size], None
+		return None, status_name(status)
+
+	async def read_attempts(self, address, errors=()):
+		errors = list(errors)
+		while len(errors) < self.max_attempts:
+			if errors:
+				await self.backoff(len(errors) - 1)
+			await self.send(self.codec.encode_read(address))
+			data, error = await self.receive_frame(address)
+			if error is None:
+				return data
+			if error not in CARD_ERRORS:
+				await self.flush()
+			errors.append(error)
+		raise MemCARDuinoError("frame "+str(address+1)+" failed after "+str(len(errors))+" attempts: "+", ".join(errors))
+
+	async def read_batch(self, addresses):
+		#queue a read of every address, then collect the responses in the order they were sent
+		for address in addresses:
+			await self.send(self.codec.encode_read(address))
+		frames = {}
+		failed = {}
+		for index, address in enumerate(addresses):
+			data, error = await self.receive_frame(address)
+			if error is None:
+				frames[address] = data
+				continue
+			failed[address] = [error]
+			if error not in CARD_ERRORS:
+				#the responses behind this one can't be trusted to line up anymore
+				await self.flush()
+				for behind in addresses[index + 1:]:
+					failed[behind] = []
+				break
+		for address, errors in failed.items():
+			frames[address] = await self.read_attempts(address, errors)
+		return [(address, frames[address]) for address in addresses]
+
+	async def read_frame(self, address, timeout=None):
+		return await self.request(lambda: self.read_attempts(address), timeout)
+
+	async def frames(self, start=0, end=None, depth=4, timeout=None):
+		#async iterator over (address, data) from start up to end, depth reads are queued on the link at a time
+		#the lock is only held per batch, so other requests on this client get their turn in between
+		end = self.end if end is None else end
+		depth = max(1, min(depth, MAX_DEPTH))
+		for first in range(start, end, depth):
+			addresses = range(first, min(first + depth, end))
+			for address, data in await self.request(lambda: self.read_batch(addresses), timeout):
+				yield address, data
+
+	async def read_card(self, file=None, depth=4, timeout=None):
+		#whole card as one image, also written to file when given
+		image = bytearray(self.end * self.frame_size)
+		async for address, data in self.frames(0, self.end, depth, timeout):
+			image[address * self.frame_size:(address + 1) * self.frame_size] = data
+		if file is not None:
+			file.write(image)
+		return image
+
+	async def write_attempts(self, address, data_block):
+		errors = []
+		while len(errors) < self.max_attempts:
+			if errors:
+				await self.backoff(len(errors) - 1)
+			await self.send(self.codec.encode_write(address, data_block))
+			b = await self.recv(1)
+			if(b == b'\x47'):
+				return True
+			errors.append(status_name(b[0] if b else -1))
+			await self.flush()
+		return False
+
+	async def write_frame(self, address, data, timeout=None):
+		return await self.request(lambda: self.write_attempts(address, data), timeout)
+
+	# PocketStation Functions
+	async def ps_info(self, timeout=None):
+		#serial number and clock of the pocketstation, None if there is no pocketstation
+		async def operation():
+			await self.send(PSINFO)
+			b = await self.recv(1)
+			if(len(b) != 1 or b[0] != 0x12):
+				return None
+			return ps_info_fields(await self.recv(0x12))
+		return await self.request(operation, timeout)
+
+	async def ps_bios(self, file, timeout=None):
+		#dump the pocketstation bios to file, returns its checksum
+		#failed chunks are retried after the rest and land at their own offset, MemCARDuinoError if any still fail
+		async def operation():
+			image = bytearray(BIOS_SIZE)
+			remaining = list(range(BIOS_CHUNKS))
+			found = False
+			for attempt in range(self.max_attempts):
+				if attempt:
+					await self.backoff(attempt - 1)
+				failed = []
+				for chunk in remaining:
+					await self.send(PSBIOS + bytes((chunk,)))
+					#parameter and datasize check, without a pocketstation only one byte comes back
+					b = await self.recv(1)
+					if b == b'\x05':
+						b += await self.recv(1)
+					if b == b'\x05\x80':
+						temp = await self.recv(BIOS_CHUNK + 1)
+						if len(temp) == BIOS_CHUNK + 1 and temp[-1] == 0x47:
+							image[chunk * BIOS_CHUNK:(chunk + 1) * BIOS_CHUNK] = temp[0:BIOS_CHUNK]
+							found = True
+							continue
+					elif not found and len(b) == 1:
+						await self.flush()
+						raise MemCARDuinoError("pocketstation not found")
+					failed.append(chunk)
+					await self.flush()
+				remaining = failed
+				if not remaining:
+					break
+			file.write(image)
+			if remaining:
+				raise MemCARDuinoError(str(len(remaining))+" bios chunks failed after "+str(self.max_attempts)+" attempts, saved as \\x00")
+			return bios_checksum(image)
+		return await self.request(operation, timeout)
+
+	async def ps_time(self, now=None, timeout=None):
+		#set the pocketstation clock, to the current time by default
+		if now is None:
+			now = datetime.now()
+		async def operation():
+			await self.send(PSTIME)
+			#parameter and datasize check
+			if(await self.recv(2) != b'\x00\x08'):
+				return False
+			await self.send(ps_time_data(now))
+			return await self.recv(1) == b'\x47'
+		return await self.request(operation, timeout)
+
+async def dump(port, file, capacity):
+	tStart = datetime.now()
+	try:
+		async with AsyncMemCardClient(port, capacity=capacity) as client:
+			with open(file, 'wb') as f:
+				await client.read_card(f)
+	except MemCARDuinoError as e:
+		print(port+": ERROR: "+str(e))
+		return False
+	print(port+": "+file+" "+str(datetime.now() - tStart))
+	return True
+
+async def dump_all(ports, file, capacity):
+	return await asyncio.gather(*[dump(port, device_file(file, port) if len(ports) > 1 else file, capacity) for port in ports])
+
+def help():
+	print("memcarduino_async usage:")
+	print("memcarduino_async.py -p,--port <serial port> -r,--read <output file> [-c,--capacity <capacity>]")
+	print("reads every card at once from a single event loop, -p takes several ports like memcarduino.py\n")
+
+def main(argv=None):
+	if argv is None:
+		argv = sys.argv[1:]
+	patterns = []
+	file = ""
+	capacity = 1024
+	opts, args = getopt.getopt(argv, "hp:r:c:", ["help", "port=", "read=", "capacity="])
+	for opt, arg in opts:
+		if opt in ("-h", "--help"):
+			help()
+			sys.exit()
+		elif opt in ("-p", "--port"):
+			patterns.append(arg)
+		elif opt in ("-r", "--read"):
+			file = arg
+		elif opt in ("-c", "--capacity"):
+			capacity = int(arg)
+	ports = expand_ports(patterns)
+	if not ports or file == "":
+		help()
+		sys.exit()
+	tStart = datetime.now()
+	results = asyncio.run(dump_all(ports, file, capacity))
+	print(str(results.count(True))+"/"+str(len(ports))+" cards read in "+str(datetime.now() - tStart))
+
+if __name__ == "__main__":
+	main()
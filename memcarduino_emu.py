@@ -0,0 +1,567 @@
+#!python3
+
+#MemCARDuino device emulator
+#serves the MemCARDuino serial protocol (see DEVELOPERS.md and MemCARDuino.ino) on a linux pseudo-terminal
+#so memcarduino.py can be tested and benchmarked without a board or a Memory Card attached.
+#point memcarduino.py at the printed /dev/pts/N port like it was a real device.
+#use and modification of this script is allowed, if improved do send a copy back.
+import os
+import sys
+import tty
+import time
+import random
+import select
+import socket
+import getopt
+import threading
+import queue
+from datetime import datetime
+
+GETID = 0xA0
+GETVER = 0xA1
+MCREAD = 0xA2
+MCWRITE = 0xA3
+MCREADN = 0xA5
+MCWRITEN = 0xA6
+MCREADC = 0xA7
+MCWRITEC = 0xA8
+GETSTATS = 0xA9
+
+PSINFO = 0xB0
+PSBIOS = 0xB1
+PSTIME = 0xB2
+
+TEST = 0x54
+
+IDENTIFIER = b"MCDINO"
+VERSION = 0x0C
+
+ERROR = 0xE0
+RW_GOOD = 0x47
+RW_BAD_CHECKSUM = 0x4E
+RW_NO_CARD = 0xFF		# also returned for frames outside of the card (bad sector)
+
+FRAME_SIZE = 128
+SEND_PIECE = 16		# bytes the emulated link delivers at a time
+
+# compact frame encodings of MCREADC/MCWRITEC, first byte of every frame
+FRAME_RAW = 0x00
+FRAME_FILL = 0x01
+FRAME_RLE = 0x02
+MAX_RUNS = 63
+BIOS_SIZE = 0x4000
+
+# timing counters of GETSTATS, in the order the firmware sends them
+STAT_FRAMES_READ = 0
+STAT_FRAMES_WRITTEN = 1
+STAT_BAD_STATUS = 2
+STAT_ACK_TIMEOUTS = 3
+STAT_ACK_WAIT = 4		# us
+STAT_PADDING = 5		# us
+STAT_CARD_BYTES = 6
+STATS_COUNT = 7
+
+# bytes the firmware exchanges with the card and the fixed delays (us) it pads them with, per frame or bios chunk
+READ_EXCHANGE = (140, 340 + 140 * 20)
+WRITE_EXCHANGE = (138, 270 + 138 * 20 + 500)
+BIOS_EXCHANGE = (139, 139 * 65)
+NO_POCKETSTATION_EXCHANGE = (4, 4 * 65)
+NO_CARD_ACK_WAIT = {STAT_FRAMES_READ: 36900, STAT_FRAMES_WRITTEN: 24300}	# us polling for ACKs that never come
+
+def XorElementByteArray( byteStr):  # XOR of all elemment f Byte
+	result=0
+	for index in range(0, len(byteStr)):
+		result=result^byteStr[index]
+	return result
+
+def compact_frame(data):
+	#same choice as the firmware's SendCompactFrame: fill byte, runs or raw data, whichever is shortest
+	#followed by the check byte, XOR of the encoded frame
+	runs = []
+	start = 0
+	for index in range(1, len(data) + 1):
+		if index == len(data) or data[index] != data[start]:
+			runs.append((index - start, data[start]))
+			start = index
+	if len(runs) == 1:
+		encoded = bytes([FRAME_FILL, data[0]])
+	elif len(runs) <= MAX_RUNS:
+		encoded = bytes([FRAME_RLE, len(runs)]) + bytes(byte for run in runs for byte in run)
+	else:
+		encoded = bytes([FRAME_RAW]) + bytes(data)
+	return encoded + bytes([XorElementByteArray(encoded)])
+
+def get_bcd(value):
+	return ((value // 10) << 4) | (value % 10)
+
+class MemCARDuinoEmulator:
+	"""Software stand-in for a MemCARDuino board with a Memory Card or PocketStation plugged in.
+
+	Latencies are in seconds. byte_delay is charged for every byte crossing the serial link
+	(10 bits per byte at the emulated bitrate), command_delay mirrors the firmware's delay(5)
+	before parsing parameters and read_delay/write_delay are the time the card takes per frame.
+	link_latency is the USB-serial adapter round trip added to every response without holding
+	up the emulated board, like an adapter latency timer would.
+	Fault rates are probabilities per frame (0.0 - 1.0).
+	"""
+
+	def __init__(self, image=None, capacity=1024, card=True, pocketstation=False, bios=None,
+			rate=115200, command_delay=0.005, read_delay=0.010, write_delay=0.020, link_latency=0.0,
+			bad_checksum_rate=0.0, corrupt_rate=0.0, drop_rate=0.0, bad_frames=(), seed=None):
+		self.capacity = capacity
+		self.card = card
+		self.pocketstation = pocketstation
+		self.byte_delay = 10.0 / rate if rate else 0.0
+		self.command_delay = command_delay
+		self.read_delay = read_delay
+		self.write_delay = write_delay
+		self.link_latency = link_latency
+		self.bad_checksum_rate = bad_checksum_rate
+		self.corrupt_rate = corrupt_rate
+		self.drop_rate = drop_rate
+		self.bad_frames = set(bad_frames)
+		self.random = random.Random(seed)
+
+		#card contents, optionally backed by an image file that receives every written frame
+		self.image_fd = None
+		self.image = bytearray(capacity * FRAME_SIZE)
+		if image is not None:
+			self.image_fd = os.open(image, os.O_RDWR | os.O_CREAT, 0o644)
+			data = os.pread(self.image_fd, len(self.image), 0)
+			self.image[0:len(data)] = data
+			if len(data) < len(self.image):
+				os.pwrite(self.image_fd, bytes(self.image[len(data):]), len(data))
+
+		if bios is not None:
+			with open(bios, 'rb') as f:
+				self.bios = bytearray(f.read(BIOS_SIZE).ljust(BIOS_SIZE, b"\x00"))
+		else:
+			self.bios = bytearray((index * 7 + (index >> 8)) & 0xFF for index in range(BIOS_SIZE))
+		self.clock_offset = 0.0		# PocketStation clock relative to the host clock, set by PSTIME
+
+		#counters, useful when benchmarking
+		self.frames_read = 0
+		self.frames_written = 0
+		self.bytes_in = 0
+		self.bytes_out = 0
+		self.stats = [0] * STATS_COUNT	# what the firmware counts since the last GETSTATS
+
+		self.master = None
+		self.slave = None
+		self.port = None
+		self.listener = None		# tcp server socket when listening instead of using a pseudo-terminal
+		self.connection = None		# the tcp client being served, self.master is its fd
+		self.rx = bytearray()
+		self.running = False
+		self.thread = None
+		self.outgoing = queue.Queue()	# (due time, data) waiting for the link latency to pass
+		self.writer = None
+
+	# Link
+
+	def open(self):
+		self.master, self.slave = os.openpty()
+		tty.setraw(self.slave)		# no echo or line editing, the slave stays open so closing the client doesn't hang up the master
+		self.port = os.ttyname(self.slave)
+		return self.port
+
+	def listen(self, port=0, host="127.0.0.1"):
+		#serve one tcp client at a time, like a ser2net bridge in raw mode would
+		self.listener = socket.create_server((host, port))
+		self.port = "tcp://"+host+":"+str(self.listener.getsockname()[1])
+		return self.port
+
+	def accept(self, timeout):
+		ready, _, _ = select.select([self.listener], [], [], timeout)
+		if ready:
+			self.connection, _ = self.listener.accept()
+			self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			self.master = self.connection.fileno()
+			self.rx.clear()
+
+	def hang_up(self):
+		self.connection.close()
+		self.connection = None
+		self.master = None
+
+	def start(self):
+		if self.master is None and self.listener is None:
+			self.open()
+		self.running = True
+		self.thread = threading.Thread(target=self.serve, daemon=True)
+		self.thread.start()
+		return self.port
+
+	def stop(self):
+		self.running = False
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+		if self.writer is not None:
+			self.outgoing.put(None)
+			self.writer.join()
+			self.writer = None
+		if self.connection is not None:
+			self.hang_up()
+		if self.listener is not None:
+			self.listener.close()
+			self.listener = None
+		for fd in (self.master, self.slave, self.image_fd):
+			if fd is not None:
+				os.close(fd)
+		self.master = self.slave = self.image_fd = None
+
+	def recv(self, count, timeout):
+		#collect count bytes from the host, fewer if nothing arrives within timeout
+		deadline = time.monotonic() + timeout
+		while len(self.rx) < count and self.running and self.master is not None:
+			remaining = deadline - time.monotonic()
+			if remaining <= 0:
+				break
+			ready, _, _ = select.select([self.master], [], [], min(remaining, 0.1))
+			if ready:
+				data = os.read(self.master, 4096)
+				if not data:
+					self.hang_up()		# tcp client went away, wait for the next one
+					break
+				self.rx += data
+		data = bytes(self.rx[0:count])
+		del self.rx[0:count]
+		self.bytes_in += len(data)
+		return data
+
+	def send(self, data):
+		#with a bitrate the response goes out in pieces as the bytes would leave the uart, not all at once at the end
+		if self.byte_delay and len(data) > SEND_PIECE:
+			for index in range(0, len(data), SEND_PIECE):
+				self.send(data[index:index + SEND_PIECE])
+			return
+		if self.byte_delay:
+			time.sleep(len(data) * self.byte_delay)
+		self.bytes_out += len(data)
+		if not self.link_latency:
+			self.write_out(data)
+			return
+		if self.writer is None:
+			self.writer = threading.Thread(target=self.deliver, daemon=True)
+			self.writer.start()
+		self.outgoing.put((time.monotonic() + self.link_latency, data))
+
+	def deliver(self):
+		while True:
+			item = self.outgoing.get()
+			if item is None:
+				return
+			due, data = item
+			delay = due - time.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+			self.write_out(data)
+
+	def write_out(self, data):
+		if self.master is None:
+			return
+		try:
+			os.write(self.master, data)
+		except OSError:
+			if self.connection is None:
+				raise
+
+	def chance(self, rate):
+		return rate > 0 and self.random.random() < rate
+
+	# Protocol
+
+	def serve(self):
+		while self.running:
+			if self.master is None:
+				self.accept(0.1)
+				continue
+			command = self.recv(1, 0.1)
+			if command:
+				self.handle(command[0])
+
+	def handle(self, command):
+		if command == GETID:
+			self.send(IDENTIFIER)
+		elif command == GETVER:
+			self.send(bytes([VERSION]))
+		elif command == GETSTATS:
+			self.send_stats()
+		elif command == TEST:
+			self.send(IDENTIFIER + (" %d.%X\r\n" % (VERSION >> 4, VERSION & 0xF)).encode())
+		elif command == MCREAD:
+			self.read_frame(self.address())
+		elif command == MCWRITE:
+			self.write_frame(self.address())
+		elif command == MCREADN:
+			self.read_frames()
+		elif command == MCWRITEN:
+			self.write_frames()
+		elif command == MCREADC:
+			self.read_frames(True)
+		elif command == MCWRITEC:
+			self.write_frames(True)
+		elif command == PSINFO:
+			self.ps_info()
+		elif command == PSBIOS:
+			self.ps_bios()
+		elif command == PSTIME:
+			self.ps_time()
+		else:
+			self.send(bytes([ERROR]))
+
+	def send_stats(self):
+		#count byte, then every counter as 4 bytes lsb first, and start over like SendStats
+		self.send(bytes([STATS_COUNT]) + b"".join((value & 0xFFFFFFFF).to_bytes(4, 'little') for value in self.stats))
+		self.stats = [0] * STATS_COUNT
+
+	def count_exchange(self, exchange, card_time, counter=None, status=RW_GOOD):
+		#what the firmware's counters add up for a frame or bios chunk, the card's time goes to polling for ACK
+		count, padding = exchange
+		self.stats[STAT_CARD_BYTES] += count
+		self.stats[STAT_PADDING] += padding
+		if counter is not None:
+			self.stats[counter] += 1
+			if status != RW_GOOD:
+				self.stats[STAT_BAD_STATUS] += 1
+		if counter is not None and not self.card:
+			self.stats[STAT_ACK_TIMEOUTS] += count
+			self.stats[STAT_ACK_WAIT] += NO_CARD_ACK_WAIT[counter]
+		else:
+			self.stats[STAT_ACK_WAIT] += int(card_time * 1000000)
+
+	def address(self):
+		#firmware waits 5 ms and reads both address bytes, a missing byte reads as 0xFF
+		time.sleep(self.command_delay)
+		address_bytes = self.recv(2, 0.01).ljust(2, b"\xFF")
+		return address_bytes[0] << 8 | address_bytes[1]
+
+	def batch(self):
+		#MSB, LSB of the first frame and the number of frames
+		time.sleep(self.command_delay)
+		params = self.recv(3, 0.01).ljust(3, b"\xFF")
+		start = params[0] << 8 | params[1]
+		return [(start + index) & 0xFFFF for index in range(params[2])]
+
+	def read_frames(self, compact=False):
+		for address in self.batch():
+			self.read_frame(address, compact)
+
+	def write_frames(self, compact=False):
+		for address in self.batch():
+			if not self.write_frame(address, compact):
+				return
+
+	def recv_compact(self, timeout):
+		#frame data the way ReceiveCompactFrame takes it, None if the host stopped sending
+		#b"" if the check byte or the runs don't add up, the firmware answers those like a bad checksum
+		deadline = time.monotonic() + timeout
+		def take(count):
+			data = self.recv(count, max(0, deadline - time.monotonic()))
+			return data if len(data) == count else None
+		encoding = take(1)
+		if encoding is None:
+			return None
+		if encoding[0] == FRAME_RAW:
+			payload = take(FRAME_SIZE)
+			data = payload
+		elif encoding[0] == FRAME_FILL:
+			payload = take(1)
+			data = payload * FRAME_SIZE if payload is not None else None
+		elif encoding[0] == FRAME_RLE:
+			runs = take(1)
+			pairs = take(2 * runs[0]) if runs is not None else None
+			payload = runs + pairs if pairs is not None else None
+			data = b"".join(bytes([pairs[index + 1]]) * pairs[index] for index in range(0, len(pairs), 2)) if pairs is not None else None
+		else:
+			payload = data = b""
+		check = take(1)
+		if payload is None or check is None:
+			return None
+		if len(data) != FRAME_SIZE or XorElementByteArray(encoding + payload + check) != 0:
+			return b""
+		return data
+
+	def read_frame(self, address, compact=False):
+		address_bytes = bytes([address >> 8, address & 0xFF])
+		time.sleep(self.read_delay)
+		self.frames_read += 1
+		if not self.card or address >= self.capacity or address in self.bad_frames:
+			self.count_exchange(READ_EXCHANGE, self.read_delay, STAT_FRAMES_READ, RW_NO_CARD)
+			#the firmware still encodes the 0xFF frame it clocked in, the checksum and status stay 0xFF
+			self.send((compact_frame(b"\xFF" * FRAME_SIZE) if compact else b"\xFF" * FRAME_SIZE) + b"\xFF\xFF")
+			return
+
+		data = self.image[address * FRAME_SIZE:(address + 1) * FRAME_SIZE]
+		chk = address_bytes[0] ^ address_bytes[1] ^ XorElementByteArray(data)
+		status = RW_GOOD
+		if self.chance(self.bad_checksum_rate):
+			status = RW_BAD_CHECKSUM
+		self.count_exchange(READ_EXCHANGE, self.read_delay, STAT_FRAMES_READ, status)
+		response = bytearray(compact_frame(data) if compact else data)
+		if self.chance(self.corrupt_rate):
+			response[self.random.randrange(len(response))] ^= 1 << self.random.randrange(8)
+		response = bytes(response) + bytes([chk, status])
+		if self.chance(self.drop_rate):
+			index = self.random.randrange(len(response))
+			response = response[:index] + response[index + 1:]
+		self.send(response)
+
+	def write_frame(self, address, compact=False):
+		#returns False when the firmware gives up on the frame because the data didn't arrive within 30 ms
+		address_bytes = bytes([address >> 8, address & 0xFF])
+		if compact:
+			data = self.recv_compact(0.03)
+			if data is None:
+				return False
+		else:
+			data = self.recv(FRAME_SIZE, 0.03)
+			if len(data) < FRAME_SIZE:
+				return False
+		chk = self.recv(1, 0.01).ljust(1, b"\xFF")[0]
+		if not data:
+			#a compact frame that failed its check never reaches the card
+			self.send(bytes([RW_BAD_CHECKSUM]))
+			return True
+		time.sleep(self.write_delay)
+		self.frames_written += 1
+
+		if not self.card or address >= self.capacity or address in self.bad_frames:
+			status = RW_NO_CARD
+		elif chk != address_bytes[0] ^ address_bytes[1] ^ XorElementByteArray(data) or self.chance(self.bad_checksum_rate):
+			status = RW_BAD_CHECKSUM
+		else:
+			status = RW_GOOD
+			self.image[address * FRAME_SIZE:(address + 1) * FRAME_SIZE] = data
+			if self.image_fd is not None:
+				os.pwrite(self.image_fd, data, address * FRAME_SIZE)
+		self.count_exchange(WRITE_EXCHANGE, self.write_delay, STAT_FRAMES_WRITTEN, status)
+		if not self.chance(self.drop_rate):
+			self.send(bytes([status]))
+		return True
+
+	def ps_now(self):
+		return datetime.fromtimestamp(time.time() + self.clock_offset)
+
+	def ps_info(self):
+		if not self.pocketstation:
+			self.send(b"\xFF" * (0x12 + 1))
+			return
+		now = self.ps_now()
+		info = bytearray(0x12)
+		info[6:9] = (1234567).to_bytes(3, 'little')		# serial number
+		info[9] = ord('C')
+		info[10] = get_bcd(now.day)
+		info[11] = get_bcd(now.month)
+		info[12] = get_bcd(now.year % 100)
+		info[13] = get_bcd(now.year // 100)
+		info[14] = get_bcd(now.second)
+		info[15] = get_bcd(now.minute)
+		info[16] = get_bcd(now.hour)
+		info[17] = (now.weekday() + 2) % 7
+		self.send(b"\x12" + bytes(info))
+
+	def ps_bios(self):
+		time.sleep(self.command_delay)
+		part = self.recv(1, 0.01).ljust(1, b"\xFF")[0]
+		if not self.pocketstation:
+			self.count_exchange(NO_POCKETSTATION_EXCHANGE, 0)
+			self.send(b"\xFF")
+			return
+		time.sleep(self.read_delay)
+		self.count_exchange(BIOS_EXCHANGE, self.read_delay)
+		data = bytes(self.bios[part * FRAME_SIZE:(part + 1) * FRAME_SIZE]).ljust(FRAME_SIZE, b"\xFF")
+		response = b"\x05\x80" + data + bytes([RW_GOOD])
+		if self.chance(self.drop_rate):
+			index = self.random.randrange(len(response))
+			response = response[:index] + response[index + 1:]
+		self.send(response)
+
+	def ps_time(self):
+		if not self.pocketstation:
+			self.send(b"\xFF")
+			return
+		self.send(b"\x00\x08")
+		data = self.recv(8, 0.03)
+		if len(data) < 8:
+			return
+		bcd = [(value >> 4) * 10 + (value & 0xF) for value in data]
+		try:
+			target = datetime(bcd[3] * 100 + bcd[2], bcd[1], bcd[0], bcd[6], bcd[5], bcd[4])
+			self.clock_offset = target.timestamp() - time.time()
+		except ValueError:
+			pass
+		self.send(bytes([RW_GOOD]))
+
+def help():
+	print("memcarduino_emu usage:")
+	print("memcarduino_emu.py [-i,--image <image file>] [-c,--capacity <capacity>] [-b,--bitrate <bitrate:bps>] [--no-card] [--pocketstation] [--bios <bios file>]")
+	print("                   [--read-delay <ms>] [--write-delay <ms>] [--latency <ms>] [--bad-checksum <rate>] [--corrupt <rate>] [--drop <rate>] [--bad-frame <frame>] [--seed <seed>] [--tcp <port>]")
+	print("<image file> memory card image backing the emulated card, written frames are saved to it (default blank in-memory card)")
+	print("<capacity> emulated memory card capacity [frames] (default 1024 frames)")
+	print("<bitrate> emulated serial link speed, 0 for no per byte delay (default 115200 bps)")
+	print("--read-delay/--write-delay time the card takes per frame (default 10/20 ms)")
+	print("--latency round trip latency of the emulated usb-serial adapter, added to every response (default 0 ms)")
+	print("--bad-checksum/--corrupt/--drop fault probability per frame: 0x4E status, flipped data bit on the link, dropped response byte (also per bios chunk)")
+	print("--bad-frame <frame> frame that always answers with 0xFF (bad sector), can be repeated")
+	print("--tcp <port> listens on 127.0.0.1:<port> instead of a pseudo-terminal, connect with -p tcp://127.0.0.1:<port>\n")
+
+def main():
+	options = {}
+	bad_frames = []
+	tcp_port = None
+	opts, args = getopt.getopt(sys.argv[1:], "hi:c:b:", ["help", "image=", "capacity=", "bitrate=", "no-card", "pocketstation",
+		"bios=", "read-delay=", "write-delay=", "latency=", "bad-checksum=", "corrupt=", "drop=", "bad-frame=", "seed=", "tcp="])
+	for opt, arg in opts:
+		if opt in ("-h", "--help"):
+			help()
+			sys.exit()
+		elif opt in ("-i", "--image"):
+			options["image"] = arg
+		elif opt in ("-c", "--capacity"):
+			options["capacity"] = int(arg)
+		elif opt in ("-b", "--bitrate"):
+			options["rate"] = int(arg)
+		elif opt == "--no-card":
+			options["card"] = False
+		elif opt == "--pocketstation":
+			options["pocketstation"] = True
+		elif opt == "--bios":
+			options["bios"] = arg
+		elif opt == "--read-delay":
+			options["read_delay"] = float(arg) / 1000
+		elif opt == "--write-delay":
+			options["write_delay"] = float(arg) / 1000
+		elif opt == "--latency":
+			options["link_latency"] = float(arg) / 1000
+		elif opt == "--bad-checksum":
+			options["bad_checksum_rate"] = float(arg)
+		elif opt == "--corrupt":
+			options["corrupt_rate"] = float(arg)
+		elif opt == "--drop":
+			options["drop_rate"] = float(arg)
+		elif opt == "--bad-frame":
+			bad_frames.append(int(arg, 0))
+		elif opt == "--seed":
+			options["seed"] = int(arg)
+		elif opt == "--tcp":
+			tcp_port = int(arg)
+	options["bad_frames"] = bad_frames
+
+	emulator = MemCARDuinoEmulator(**options)
+	if tcp_port is not None:
+		print("MemCARDuino emulator listening on " + emulator.listen(tcp_port))
+	else:
+		print("MemCARDuino emulator listening on " + emulator.open())
+	emulator.running = True
+	try:
+		emulator.serve()
+	except KeyboardInterrupt:
+		pass
+	emulator.running = False
+	print("\nframes read: " + str(emulator.frames_read) + "  frames written: " + str(emulator.frames_written))
+	emulator.stop()
+
+if __name__ == "__main__":
+	main()